@@ -1,21 +1,39 @@
 import cv2
 import numpy as np
 import random
+import itertools
+import json
 import os
-
-def get_max_image_dimensions(folder_path):
-    """Get the maximum width and height of all images in the folder."""
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import instrument
+from background_bank import (BackgroundBank, MixedBackgrounds, SyntheticBackgrounds,
+                             get_background_bank, register_background_bank)
+from file_utils import list_images, save_json
+from image_probe import image_sizes
+from image_shards import open_writer
+
+def get_max_image_dimensions(folder_path, filenames=None, manifest_path=None):
+    """Get the maximum width and height of all images in the folder.
+
+    Dimensions are read from the image headers and cached in a size manifest
+    (by default .image_sizes.json in the folder), so later runs only probe new
+    or changed files.
+    """
+    if filenames is None:
+        filenames = list_images(folder_path)
+    if manifest_path is None:
+        manifest_path = os.path.join(folder_path, '.image_sizes.json')
+    with instrument.stage('image_sizes'):
+        sizes = image_sizes([os.path.join(folder_path, filename) for filename in filenames], manifest_path)
     max_width = 0
     max_height = 0
-    for filename in os.listdir(folder_path):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff')):
-            image_path = os.path.join(folder_path, filename)
-            image = cv2.imread(image_path)
-            h, w, _ = image.shape
-            if w > max_width:
-                max_width = w
-            if h > max_height:
-                max_height = h
+    for w, h in sizes.values():
+        if w > max_width:
+            max_width = w
+        if h > max_height:
+            max_height = h
     return max_width, max_height
 
 def rotate_image(image, angle):
@@ -50,6 +68,16 @@ def adjust_brightness_contrast(image, alpha, beta):
     adjusted = cv2.convertScaleAbs(image, alpha=alpha, beta=beta)
     return adjusted, f"_brightness_{alpha:.2f}_{beta}"
 
+def gamma_lut(gamma):
+    """Lookup table applying gamma correction to 8-bit values."""
+    values = np.arange(256, dtype=np.float32) / 255.0
+    return np.clip(np.round(np.power(values, 1.0 / gamma) * 255.0), 0, 255).astype(np.uint8)
+
+def adjust_gamma(image, gamma):
+    """Apply gamma correction to the image."""
+    adjusted = cv2.LUT(image, gamma_lut(gamma))
+    return adjusted, f"_gamma_{gamma:.2f}"
+
 def blur_image(image):
     """Apply Gaussian blur to the image."""
     blurred = cv2.GaussianBlur(image, (5, 5), 0)
@@ -107,14 +135,216 @@ def add_gaussian_noise(image):
     noisy = np.clip(noisy, 0, 255)  # Ensure pixel values are within [0, 255]
     return noisy.astype(np.uint8), "_gaussian_noise"
 
+# Default parameter ranges of the pipeline ops. A (low, high) pair is sampled
+# uniformly for every image; a plain number is used as is.
+OP_DEFAULTS = {
+    'rotate': {'angle': (-50, 50)},
+    'flip': {},
+    'scale': {'factor': (0.8, 1.2)},
+    'translate': {'x': (-0.1, 0.1), 'y': (-0.1, 0.1)},  # fractions of width and height
+    'brightness': {'alpha': (0.8, 1.2), 'beta': (-30, 30)},
+    'gamma': {'gamma': (0.7, 1.5)},
+    'blur': {},
+    'sharpen': {},
+    'salt_pepper': {'amount': 0.05},
+    'gaussian_noise': {},
+    'hue_shift': {},
+    'crop': {},
+}
+AFFINE_OPS = ('rotate', 'flip', 'scale', 'translate')
+POINTWISE_OPS = ('brightness', 'gamma')
+
+# Same outputs as the original hard-coded augment_and_save_image
+DEFAULT_PIPELINE = ['flip', 'brightness', 'blur', 'sharpen']
+
+def _sample(value, integer=False):
+    if isinstance(value, (tuple, list)):
+        low, high = value
+        return random.randint(low, high) if integer else random.uniform(low, high)
+    return value
+
+def _sample_params(name, params):
+    """Draw the concrete parameters for one op, in the same order the original code drew them."""
+    if name == 'rotate':
+        return {'angle': _sample(params['angle'])}
+    if name == 'scale':
+        return {'factor': _sample(params['factor'])}
+    if name == 'translate':
+        return {'x': _sample(params['x']), 'y': _sample(params['y'])}
+    if name == 'brightness':
+        return {'alpha': _sample(params['alpha']), 'beta': _sample(params['beta'], integer=True)}
+    if name == 'gamma':
+        return {'gamma': _sample(params['gamma'])}
+    if name == 'salt_pepper':
+        return {'amount': _sample(params['amount'])}
+    return {}
+
+def _apply_single(name, image, values):
+    """Apply one op with the original per-image function."""
+    if name == 'rotate':
+        return rotate_image(image, values['angle'])
+    if name == 'flip':
+        return flip_image(image)
+    if name == 'scale':
+        return scale_image(image, values['factor'])
+    if name == 'translate':
+        return translate_image(image, values['x'] * image.shape[1], values['y'] * image.shape[0])
+    if name == 'brightness':
+        return adjust_brightness_contrast(image, values['alpha'], values['beta'])
+    if name == 'gamma':
+        return adjust_gamma(image, values['gamma'])
+    if name == 'salt_pepper':
+        return add_salt_pepper_noise(image, values['amount'])
+    return {
+        'blur': blur_image,
+        'sharpen': sharpen_image,
+        'gaussian_noise': add_gaussian_noise,
+        'hue_shift': hue_shift_image,
+        'crop': crop_image,
+    }[name](image)
+
+def _affine_step(name, values, w, h):
+    """Return the 3x3 matrix, output size and suffix of one affine op on a w x h canvas."""
+    if name == 'rotate':
+        M = np.vstack([cv2.getRotationMatrix2D((w // 2, h // 2), values['angle'], 1.0), [0, 0, 1]])
+        return M, (w, h), "_rotate"
+    if name == 'flip':
+        M = np.array([[-1, 0, w - 1], [0, -1, h - 1], [0, 0, 1]], np.float64)
+        return M, (w, h), "_flip"
+    if name == 'scale':
+        factor = values['factor']
+        new_w, new_h = int(w * factor), int(h * factor)
+        sx, sy = new_w / w, new_h / h
+        # Pixel-centre aligned, like cv2.resize
+        M = np.array([[sx, 0, 0.5 * (sx - 1)], [0, sy, 0.5 * (sy - 1)], [0, 0, 1]], np.float64)
+        return M, (new_w, new_h), f"_scale_{factor:.2f}"
+    x, y = values['x'] * w, values['y'] * h
+    M = np.array([[1, 0, x], [0, 1, y], [0, 0, 1]], np.float64)
+    return M, (w, h), f"_translate_{x:.2f}_{y:.2f}"
+
+def _apply_fused_affine(image, steps):
+    """Collapse a run of affine ops into a single warpAffine."""
+    h, w = image.shape[:2]
+    M = np.eye(3)
+    suffix = ""
+    for name, values in steps:
+        step, (w, h), step_suffix = _affine_step(name, values, w, h)
+        M = step @ M
+        suffix += step_suffix
+    return cv2.warpAffine(image, M[:2], (w, h)), suffix
+
+def _apply_fused_pointwise(image, steps):
+    """Collapse a run of pointwise ops into a single lookup-table pass."""
+    lut = np.arange(256, dtype=np.uint8)
+    suffix = ""
+    for name, values in steps:
+        if name == 'brightness':
+            step = cv2.convertScaleAbs(np.arange(256, dtype=np.uint8).reshape(1, 256),
+                                       alpha=values['alpha'], beta=values['beta']).reshape(256)
+            suffix += f"_brightness_{values['alpha']:.2f}_{values['beta']}"
+        else:
+            step = gamma_lut(values['gamma'])
+            suffix += f"_gamma_{values['gamma']:.2f}"
+        lut = step[lut]
+    return cv2.LUT(image, lut), suffix
+
+def _op_kind(name):
+    if name in AFFINE_OPS:
+        return 'affine'
+    if name in POINTWISE_OPS:
+        return 'pointwise'
+    return name
+
+class AugmentPipeline:
+    """Declarative list of augmentation variants, each producing one output image.
+
+    `ops` is either a dict {op_name: probability} or a list whose entries are
+    - an op name, e.g. 'flip'
+    - a dict with one op and its settings, e.g. {'op': 'rotate', 'angle': (30, 50), 'p': 0.5}
+    - a chain, e.g. {'ops': ['rotate', {'op': 'brightness', 'beta': (-10, 10)}, 'gaussian_noise']}
+    An entry may also carry 'suffix', which is appended to the generated filename suffix.
+
+    Adjacent affine ops in a chain (rotate, flip, scale, translate) are fused
+    into one warpAffine and adjacent pointwise ops (brightness, gamma) into one
+    lookup table, so a chain makes one pass over the pixels per group.
+    """
+
+    def __init__(self, ops=None):
+        if ops is None:
+            ops = DEFAULT_PIPELINE
+        if isinstance(ops, dict):
+            ops = [{'op': name, 'p': p} for name, p in ops.items()]
+        self.variants = [self._parse_variant(entry) for entry in ops]
+
+    @staticmethod
+    def _parse_op(entry):
+        if isinstance(entry, str):
+            entry = {'op': entry}
+        name = entry['op']
+        if name not in OP_DEFAULTS:
+            raise ValueError(f"Unknown augmentation op: {name}")
+        params = dict(OP_DEFAULTS[name])
+        params.update((k, v) for k, v in entry.items() if k not in ('op', 'p', 'suffix'))
+        return name, params
+
+    def _parse_variant(self, entry):
+        if isinstance(entry, str):
+            entry = {'op': entry}
+        chain = entry['ops'] if 'ops' in entry else [entry]
+        return {
+            'ops': [self._parse_op(op) for op in chain],
+            'p': entry.get('p', 1.0),
+            'suffix': entry.get('suffix', ''),
+        }
+
+    def apply_chain(self, image, ops):
+        """Run one chain of ops on image and return (augmented image, suffix)."""
+        groups = []
+        for name, params in ops:
+            values = _sample_params(name, params)
+            if groups and _op_kind(name) in ('affine', 'pointwise') and groups[-1][0] == _op_kind(name):
+                groups[-1][1].append((name, values))
+            else:
+                groups.append((_op_kind(name), [(name, values)]))
+
+        suffix = ""
+        for kind, steps in groups:
+            if len(steps) == 1:
+                with instrument.stage('transform.' + steps[0][0]):
+                    image, step_suffix = _apply_single(steps[0][0], image, steps[0][1])
+            elif kind == 'affine':
+                with instrument.stage('transform.fused_affine'):
+                    image, step_suffix = _apply_fused_affine(image, steps)
+            else:
+                with instrument.stage('transform.fused_pointwise'):
+                    image, step_suffix = _apply_fused_pointwise(image, steps)
+            suffix += step_suffix
+        return image, suffix
+
+    def __call__(self, image):
+        """Return [(suffix, augmented image)] for every variant that fires on this image."""
+        outputs = []
+        for variant in self.variants:
+            if variant['p'] < 1.0 and random.random() >= variant['p']:
+                continue
+            augmented, suffix = self.apply_chain(image, variant['ops'])
+            outputs.append((suffix + variant['suffix'], augmented))
+        return outputs
+
 def place_image_on_background(image, background_folder):
-    """Place the image onto a random background at a random position."""
-    background_filename = random.choice(os.listdir(background_folder))
-    background_path = os.path.join(background_folder, background_filename)
-    background = cv2.imread(background_path)
-    
-    bg_h, bg_w, _ = background.shape
+    """Place the image onto a random background at a random position.
+
+    background_folder may be a folder path or a background source such as a
+    BackgroundBank or SyntheticBackgrounds.
+    """
+    if isinstance(background_folder, (str, os.PathLike)):
+        source = get_background_bank(background_folder)
+    else:
+        source = background_folder
     img_h, img_w, _ = image.shape
+    background = source.random_background(img_w, img_h)
+
+    bg_h, bg_w, _ = background.shape
 
     if img_h > bg_h or img_w > bg_w:
         #raise ValueError("The image is larger than the background.")
@@ -130,118 +360,222 @@ def place_image_on_background(image, background_folder):
 
     return combined
 
-def augment_and_save_image(image, original_filename, save_folder, background_folder):
-    """Apply various augmentations to an image and save each version."""
+def augment_and_save_image(image, original_filename, save_folder, background_folder, pipeline=None, writer=None):
+    """Apply the augmentation pipeline to an image and save each version.
+
+    If writer (an AsyncImageWriter) is given, images are queued on it instead
+    of being written before this function returns.
+    """
+    if not isinstance(pipeline, AugmentPipeline):
+        pipeline = AugmentPipeline(pipeline)
     augmented_images = []
 
-    image = place_image_on_background(image, background_folder)
-
-    # # Rotate
-    # angle = random.uniform(-50,-30)
-    # rotated_image, suffix = rotate_image(image, angle)
-    # rotated_filename = os.path.join(save_folder, os.path.splitext(original_filename)[0] + suffix + os.path.splitext(original_filename)[1])
-    # cv2.imwrite(rotated_filename, rotated_image)
-    # augmented_images.append(rotated_filename)
-
-    # # Rotate
-    # angle = random.uniform(30, 50)
-    # rotated_image, suffix = rotate_image(image, angle)
-    # rotated_filename = os.path.join(save_folder, os.path.splitext(original_filename)[0] + suffix + "_2" + os.path.splitext(original_filename)[1] )
-    # cv2.imwrite(rotated_filename, rotated_image)
-    # augmented_images.append(rotated_filename)
-
-    # Flip
-    flipped_image, suffix = flip_image(image)
-    flipped_filename = os.path.join(save_folder, os.path.splitext(original_filename)[0] + suffix + os.path.splitext(original_filename)[1])
-    cv2.imwrite(flipped_filename, flipped_image)
-    augmented_images.append(flipped_filename)
-
-    # # Scale
-    # scale_factor = random.uniform(0.8, 1.2)
-    # scaled_image, suffix = scale_image(image, scale_factor)
-    # scaled_filename = os.path.join(save_folder, os.path.splitext(original_filename)[0] + suffix + os.path.splitext(original_filename)[1])
-    # cv2.imwrite(scaled_filename, scaled_image)
-    # augmented_images.append(scaled_filename)
-
-    # # Translate
-    # x = random.uniform(-0.1, 0.1) * image.shape[1]
-    # y = random.uniform(-0.1, 0.1) * image.shape[0]
-    # translated_image, suffix = translate_image(image, x, y)
-    # translated_filename = os.path.join(save_folder, os.path.splitext(original_filename)[0] + suffix + os.path.splitext(original_filename)[1])
-    # cv2.imwrite(translated_filename, translated_image)
-    # augmented_images.append(translated_filename)
-
-    # Adjust brightness and contrast
-    alpha = random.uniform(0.8, 1.2)
-    beta = random.randint(-30, 30)
-    adjusted_image, suffix = adjust_brightness_contrast(image, alpha, beta)
-    adjusted_filename = os.path.join(save_folder, os.path.splitext(original_filename)[0] + suffix + os.path.splitext(original_filename)[1])
-    cv2.imwrite(adjusted_filename, adjusted_image)
-    augmented_images.append(adjusted_filename)
-
-    # Blur
-    blurred_image, suffix = blur_image(image)
-    blurred_filename = os.path.join(save_folder, os.path.splitext(original_filename)[0] + suffix + os.path.splitext(original_filename)[1])
-    cv2.imwrite(blurred_filename, blurred_image)
-    augmented_images.append(blurred_filename)
-
-    # # Salt and pepper noise
-    # noisy_image, suffix = add_salt_pepper_noise(image, 0.05)
-    # noisy_filename = os.path.join(save_folder, os.path.splitext(original_filename)[0] + suffix + os.path.splitext(original_filename)[1])
-    # cv2.imwrite(noisy_filename, noisy_image)
-    # augmented_images.append(noisy_filename)
-
-    # Hue shift
-    # hue_shifted_image, suffix = hue_shift_image(image)
-    # hue_shifted_filename = os.path.join(save_folder, os.path.splitext(original_filename)[0] + suffix + os.path.splitext(original_filename)[1])
-    # cv2.imwrite(hue_shifted_filename, hue_shifted_image)
-    # augmented_images.append(hue_shifted_filename)
-
-    # # Crop
-    # cropped_image, suffix = crop_image(image)
-    # cropped_filename = os.path.join(save_folder, os.path.splitext(original_filename)[0] + suffix + os.path.splitext(original_filename)[1])
-    # cv2.imwrite(cropped_filename, cropped_image)
-    # augmented_images.append(cropped_filename)
-
-    # Sharpen
-    sharpened_image, suffix = sharpen_image(image)
-    sharpened_filename = os.path.join(save_folder, os.path.splitext(original_filename)[0] + suffix + os.path.splitext(original_filename)[1])
-    cv2.imwrite(sharpened_filename, sharpened_image)
-    augmented_images.append(sharpened_filename)
-
-    # Gaussian noise
-    # gaussian_noisy_image, suffix = add_gaussian_noise(image)
-    # gaussian_noisy_filename = os.path.join(save_folder, os.path.splitext(original_filename)[0] + suffix + os.path.splitext(original_filename)[1])
-    # cv2.imwrite(gaussian_noisy_filename, gaussian_noisy_image)
-    # augmented_images.append(gaussian_noisy_filename)
+    with instrument.stage('place_on_background'):
+        image = place_image_on_background(image, background_folder)
 
-    return augmented_images
+    name, ext = os.path.splitext(original_filename)
+    for suffix, augmented_image in pipeline(image):
+        augmented_filename = os.path.join(save_folder, name + suffix + ext)
+        if writer is not None:
+            augmented_filename = writer.write(augmented_filename, augmented_image,
+                                              {'source': original_filename, 'op': suffix})
+        else:
+            with instrument.stage('imwrite', path=augmented_filename):
+                cv2.imwrite(augmented_filename, augmented_image)
+        augmented_images.append(augmented_filename)
 
-def augment_images_in_folder(folder_path, background_folder):
-    """Apply augmentations to all images in a folder and save the augmented images."""
-    background_files = os.listdir(background_folder)
-    max_width, max_height = get_max_image_dimensions(folder_path)
-    if len(background_files) < len(os.listdir(folder_path)*5):
-            for i in range(len(os.listdir(folder_path))*5 - len(background_files)):
-                random_bg = cv2.randn(np.zeros((max_height+100, max_width+100, 3), np.uint8), (random.randint(0, 255), random.randint(0, 255), random.randint(0, 255)), (50, 50, 50))
-                random_bg_filename = f"background_{i}.jpg"
-                cv2.imwrite(os.path.join(background_folder, random_bg_filename), random_bg)
-            background_files = os.listdir(background_folder)
-    for filename in os.listdir(folder_path):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.tiff')):
-            image_path = os.path.join(folder_path, filename)
-            image = cv2.imread(image_path)
-
-            save_folder = folder_path  # Save augmented images in the same folder
-            augmented_image_paths = augment_and_save_image(image, filename, save_folder, background_folder)
-
-            print(f"Augmented and saved images for {filename}:")
-            for img_path in augmented_image_paths:
-                print(img_path)
-
-# Example usage
-folder_path = 'augmentinput'
-# folder_path = 'background'
-background_folder = 'background'
-augment_images_in_folder(folder_path, background_folder)
+    return augmented_images
 
+def image_seed(master_seed, filename):
+    """Derive the per-image seed for random/np.random from the master seed and filename."""
+    return (master_seed * 1000003 + zlib.crc32(filename.encode('utf-8'))) % (2 ** 32)
+
+_worker_writer = None
+
+def init_worker(background_folder, backgrounds, writer_options):
+    """Process-pool initializer: register the background source and create this process's writer."""
+    global _worker_writer
+    register_background_bank(backgrounds, background_folder)
+    _worker_writer = open_writer(**writer_options)
+
+def augment_file(filename, folder_path, save_folder, background_folder, seed, pipeline=None, writer=None):
+    """Read one image, seed the RNGs for it and augment it. Runs in worker processes."""
+    random.seed(seed)
+    np.random.seed(seed)
+    image_path = os.path.join(folder_path, filename)
+    with instrument.stage('imread', path=image_path):
+        image = cv2.imread(image_path)
+    if writer is None and _worker_writer is not None:
+        # Outputs must be on disk when the task is reported as done
+        paths = augment_and_save_image(image, filename, save_folder, background_folder, pipeline, _worker_writer)
+        _worker_writer.flush()
+        return filename, paths
+    return filename, augment_and_save_image(image, filename, save_folder, background_folder, pipeline, writer)
+
+def augment_frames(frames, background_folder, pipeline=None, seed=None):
+    """Augment an in-memory stream of (frame_id, frame) pairs.
+
+    Yields (f"{frame_id}{suffix}", augmented frame) for every pipeline variant,
+    without writing anything. Each frame is seeded from seed and its id as
+    in augment_images_in_folder.
+    """
+    if seed is None:
+        seed = random.getrandbits(32)
+    if not isinstance(pipeline, AugmentPipeline):
+        pipeline = AugmentPipeline(pipeline)
+    for frame_id, frame in frames:
+        frame_seed = image_seed(seed, str(frame_id))
+        random.seed(frame_seed)
+        np.random.seed(frame_seed)
+        with instrument.stage('place_on_background'):
+            composite = place_image_on_background(frame, background_folder)
+        for suffix, augmented in pipeline(composite):
+            yield f"{frame_id}{suffix}", augmented
+
+def load_snapshot(snapshot_path):
+    """Load a run snapshot ({'seed', 'files'}), or return None if there is none."""
+    if not os.path.exists(snapshot_path):
+        return None
+    with open(snapshot_path, 'r') as f:
+        return json.load(f)
+
+def read_log(log_path):
+    """Return the set of lines of an append-only log such as .augment_done.log. A torn last line is ignored."""
+    if not os.path.exists(log_path):
+        return set()
+    with open(log_path, 'r') as f:
+        return {line[:-1] for line in f if line.endswith('\n')}
+
+def augment_images_in_folder(folder_path, background_folder, workers=1, seed=None,
+                             background_cache_bytes=512 * 1024 * 1024, background_mmap=None,
+                             pipeline=None, writer_options=None, synthetic_kinds=('noise',), resume=True,
+                             max_pending=None):
+    """Apply augmentations to all images in a folder and save the augmented images.
+
+    With workers > 1 images are spread over a process pool. Each image is
+    augmented with its own seed derived from `seed`, so a parallel run writes
+    the same bytes as a serial run with the same master seed.
+
+    Backgrounds are decoded once into an LRU cache of background_cache_bytes.
+    If background_mmap is a file path, they are instead pre-decoded into that
+    memory-mapped file, which all worker processes share. If the folder has
+    fewer than five backgrounds per image, the rest are generated in memory
+    by SyntheticBackgrounds using synthetic_kinds, and nothing is written to
+    the background folder.
+
+    pipeline is an AugmentPipeline or its ops configuration (see
+    AugmentPipeline); the default writes flip, brightness, blur and sharpen
+    variants of each image.
+
+    Outputs are encoded and written by an AsyncImageWriter (one per process);
+    writer_options are passed to image_shards.open_writer, e.g. image_format,
+    jpeg_quality and png_compression. With shard_folder set, outputs are
+    appended to shard files there instead of being written one file each.
+
+    The list of input images is taken once, before anything is written, and
+    saved with the master seed in folder_path/.augment_snapshot.json. Images
+    whose outputs are on disk are appended to folder_path/.augment_done.log.
+    A run that finds a snapshot (and resume is True) augments only the images
+    of the snapshot that are not in the log, with the snapshot's seed, so a
+    killed run resumes where it stopped and writes the same bytes as an
+    uninterrupted run. When every image of the snapshot is done, the snapshot
+    is removed but the log is kept, so the next run takes a new snapshot of
+    only the images added since. Every output filename is recorded in
+    folder_path/.augment_outputs.log, and new snapshots leave those files out
+    too, so outputs never become inputs. resume=False clears the done log and
+    starts over with a new snapshot of every input. At most max_pending images (default 4 per worker) are in
+    flight or waiting to be checkpointed at a time.
+    """
+    if max_pending is None:
+        max_pending = 4 * max(1, workers)
+    writer_options = writer_options or {}
+    snapshot_path = os.path.join(folder_path, '.augment_snapshot.json')
+    done_path = os.path.join(folder_path, '.augment_done.log')
+    outputs_path = os.path.join(folder_path, '.augment_outputs.log')
+    snapshot = load_snapshot(snapshot_path) if resume else None
+    if snapshot is not None and seed is not None and snapshot['seed'] != seed:
+        raise ValueError(f"{snapshot_path} was taken with seed {snapshot['seed']}, not {seed}; "
+                         f"pass resume=False to start a new run")
+    if not resume and os.path.exists(done_path):
+        os.remove(done_path)
+    done = read_log(done_path)
+    if snapshot is None:
+        if seed is None:
+            seed = random.getrandbits(32)
+        # Taken before anything is written, so outputs never become inputs and finished inputs are not redone
+        skip = read_log(outputs_path) | done
+        snapshot = {'seed': seed, 'files': [f for f in list_images(folder_path) if f not in skip]}
+        save_json(snapshot, snapshot_path)
+    seed = snapshot['seed']
+    filenames = snapshot['files']
+    done &= set(filenames)
+    if done:
+        print(f"Resuming: {len(done)} of {len(filenames)} images already augmented")
+
+    max_width, max_height = get_max_image_dimensions(folder_path, filenames)
+    bank = BackgroundBank(background_folder, background_cache_bytes, background_mmap)
+    backgrounds = bank
+    if len(bank) < len(filenames)*5:
+        synthetic = SyntheticBackgrounds((max_width+100, max_height+100), synthetic_kinds)
+        backgrounds = MixedBackgrounds([(bank, len(bank)), (synthetic, len(filenames)*5 - len(bank))])
+    register_background_bank(backgrounds, background_folder)
+    save_folder = folder_path  # Save augmented images in the same folder
+    if not isinstance(pipeline, AugmentPipeline):
+        pipeline = AugmentPipeline(pipeline)
+    tasks = ((filename, folder_path, save_folder, background_folder, image_seed(seed, filename), pipeline)
+             for filename in filenames if filename not in done)
+
+    progress = instrument.Progress(len(filenames) - len(done), 'images')
+
+    def report(filename, augmented_image_paths):
+        # Outputs are registered before their input is checkpointed
+        outputs_log.writelines(os.path.basename(path) + '\n' for path in augmented_image_paths)
+        outputs_log.flush()
+        instrument.log(f"Augmented and saved images for {filename}:")
+        for img_path in augmented_image_paths:
+            instrument.log(img_path)
+        progress.update()
+
+    with open(done_path, 'a') as done_log, open(outputs_path, 'a') as outputs_log:
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                     initargs=(background_folder, backgrounds, writer_options)) as executor:
+                task = instrument.worker_task(augment_file)
+                pending = set()
+                for args in itertools.chain(tasks, [None]):
+                    # Keep at most max_pending tasks submitted, so memory stays flat for any folder size
+                    while pending and (args is None or len(pending) >= max_pending):
+                        finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            # Workers flush their outputs before returning, so the image is done
+                            filename, augmented_image_paths = instrument.task_result(future.result())
+                            report(filename, augmented_image_paths)
+                            done_log.write(filename + '\n')
+                        done_log.flush()
+                    if args is not None:
+                        pending.add(executor.submit(task, *args))
+        else:
+            with open_writer(**writer_options) as writer:
+                unflushed = []
+                for args in itertools.chain(tasks, [None]):
+                    # Checkpoint in batches: an image is done once the writer has flushed its outputs
+                    if unflushed and (args is None or len(unflushed) >= max_pending):
+                        writer.flush()
+                        done_log.writelines(filename + '\n' for filename in unflushed)
+                        done_log.flush()
+                        unflushed = []
+                    if args is not None:
+                        filename, augmented_image_paths = augment_file(*args, writer=writer)
+                        unflushed.append(filename)
+                        report(filename, augmented_image_paths)
+    progress.close()
+    # Finished: the next run takes a new snapshot; the done log keeps it from redoing these images
+    os.remove(snapshot_path)
+
+if __name__ == '__main__':
+    # Example usage
+    folder_path = 'augmentinput'
+    # folder_path = 'background'
+    background_folder = 'background'
+    # instrument.enable() before the run and instrument.report() after it print per-stage timings
+    augment_images_in_folder(folder_path, background_folder, workers=os.cpu_count(), seed=0)
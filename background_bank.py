@@ -0,0 +1,191 @@
+import json
+import os
+import random
+
+import cv2
+import numpy as np
+
+import instrument
+from file_utils import list_images, save_json
+from image_cache import LRUImageCache
+
+class BackgroundBank:
+    """Backgrounds from a folder, listed once and decoded on demand into an LRU cache.
+
+    If mmap_path is given, every background is decoded once into a single
+    memory-mapped file (plus a small JSON table next to it). Worker processes
+    that open the same file share its pages instead of decoding their own copies.
+    """
+
+    def __init__(self, folder, max_bytes=512 * 1024 * 1024, mmap_path=None):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.mmap_path = mmap_path
+        self.files = list_images(folder)
+        self.cache = LRUImageCache(max_bytes)
+        self._table = None
+        self._data = None
+        if mmap_path is not None:
+            self._open_mmap()
+
+    def __len__(self):
+        return len(self.files)
+
+    def __getstate__(self):
+        # Only ship the configuration to worker processes; they reopen the mmap themselves
+        return {'folder': self.folder, 'max_bytes': self.max_bytes, 'mmap_path': self.mmap_path}
+
+    def __setstate__(self, state):
+        self.__init__(state['folder'], state['max_bytes'], state['mmap_path'])
+
+    def _stats(self):
+        stats = {}
+        for filename in self.files:
+            st = os.stat(os.path.join(self.folder, filename))
+            stats[filename] = [st.st_size, st.st_mtime_ns]
+        return stats
+
+    def _open_mmap(self):
+        """Open the memory-mapped bank, rebuilding it if the folder changed since it was written."""
+        table_path = self.mmap_path + '.json'
+        stats = self._stats()
+        table = None
+        if os.path.exists(self.mmap_path) and os.path.exists(table_path):
+            with open(table_path, 'r') as f:
+                table = json.load(f)
+            if table['stats'] != stats:
+                table = None
+        if table is None:
+            table = self._build_mmap(stats)
+        self._table = table['entries']
+        if table['total_bytes'] > 0:
+            self._data = np.memmap(self.mmap_path, dtype=np.uint8, mode='r', shape=(table['total_bytes'],))
+
+    def _build_mmap(self, stats):
+        """Decode every background into one flat uint8 file and write its offset table."""
+        entries = {}
+        images = []
+        offset = 0
+        for filename in self.files:
+            image = cv2.imread(os.path.join(self.folder, filename))
+            if image is None:
+                continue
+            entries[filename] = [offset, list(image.shape)]
+            images.append(image)
+            offset += image.nbytes
+        if offset > 0:
+            data = np.memmap(self.mmap_path, dtype=np.uint8, mode='w+', shape=(offset,))
+            for (start, _), image in zip(entries.values(), images):
+                data[start:start + image.nbytes] = image.reshape(-1)
+            data.flush()
+            del data
+        else:
+            open(self.mmap_path, 'wb').close()
+        table = {'stats': stats, 'total_bytes': offset, 'entries': entries}
+        save_json(table, self.mmap_path + '.json')
+        return table
+
+    def load(self, filename):
+        """Return the decoded background for filename. The returned array is read-only."""
+        if self._table is not None and filename in self._table:
+            offset, shape = self._table[filename]
+            size = int(np.prod(shape))
+            return self._data[offset:offset + size].reshape(shape)
+        image = self.cache.get(filename)
+        if image is None:
+            path = os.path.join(self.folder, filename)
+            with instrument.stage('background_imread', path=path):
+                image = self.cache.put(filename, cv2.imread(path))
+        return image
+
+    def random_background(self, min_width=0, min_height=0):
+        """Pick a background uniformly at random, like random.choice over the folder.
+
+        files is sorted, so a seeded random picks the same background whatever
+        order the filesystem lists the folder in.
+
+        The size hints are accepted for compatibility with SyntheticBackgrounds
+        and ignored; backgrounds are returned at their stored size.
+        """
+        return self.load(random.choice(self.files))
+
+class SyntheticBackgrounds:
+    """Procedural backgrounds generated in memory, with the same API as BackgroundBank.
+
+    Each background is one of `kinds` ('noise', 'gradient', 'solid') and is
+    generated from a seed drawn from the random module, so runs that seed
+    random per image get the same backgrounds. Backgrounds are at least
+    `size` (width, height) and at least margin pixels larger than the
+    requested minimum size.
+    """
+
+    def __init__(self, size=None, kinds=('noise', 'gradient', 'solid'), margin=100, seed=None):
+        self.size = size or (0, 0)
+        self.kinds = tuple(kinds)
+        self.margin = margin
+        self.seed = seed
+
+    def __len__(self):
+        # Unlimited supply
+        return 2 ** 31
+
+    def random_background(self, min_width=0, min_height=0):
+        """Generate a background big enough for a min_width x min_height image."""
+        width = max(self.size[0], min_width + self.margin)
+        height = max(self.size[1], min_height + self.margin)
+        kind = random.choice(self.kinds)
+        background_seed = random.getrandbits(32)
+        if self.seed is not None:
+            background_seed = [self.seed, background_seed]
+        with instrument.stage('background_generate'):
+            return generate_background(kind, width, height, np.random.default_rng(background_seed))
+
+def generate_background(kind, width, height, rng):
+    """Generate a noise, gradient or solid-colour BGR background."""
+    if kind == 'noise':
+        # Same look as the cv2.randn backgrounds: random mean colour, sigma 50
+        mean = rng.integers(0, 256, 3).astype(np.float32)
+        background = rng.standard_normal((height, width, 3), dtype=np.float32)
+        background *= 50
+        background += mean
+        np.clip(background, 0, 255, out=background)
+        return background.astype(np.uint8)
+    if kind == 'gradient':
+        start, end = rng.integers(0, 256, (2, 3)).astype(np.float32)
+        angle = rng.uniform(0, 2 * np.pi)
+        ys, xs = np.mgrid[0:height, 0:width].astype(np.float32)
+        t = xs * np.float32(np.cos(angle)) + ys * np.float32(np.sin(angle))
+        t -= t.min()
+        t /= max(float(t.max()), 1.0)
+        background = start + t[..., None] * (end - start)
+        return background.astype(np.uint8)
+    if kind == 'solid':
+        return np.full((height, width, 3), rng.integers(0, 256, 3), np.uint8)
+    raise ValueError(f"Unknown background kind: {kind}")
+
+class MixedBackgrounds:
+    """Draw each background from one of several sources, chosen with the given weights."""
+
+    def __init__(self, sources):
+        self.sources = [source for source, weight in sources if weight > 0]
+        self.weights = [weight for source, weight in sources if weight > 0]
+
+    def random_background(self, min_width=0, min_height=0):
+        source = random.choices(self.sources, self.weights)[0]
+        return source.random_background(min_width, min_height)
+
+_banks = {}
+
+def get_background_bank(background_folder, max_bytes=512 * 1024 * 1024, mmap_path=None):
+    """Return the process-wide bank for background_folder, creating it on first use."""
+    bank = _banks.get(background_folder)
+    if bank is None:
+        bank = _banks[background_folder] = BackgroundBank(background_folder, max_bytes, mmap_path)
+    return bank
+
+def register_background_bank(bank, background_folder=None):
+    """Make bank (or any background source) the process-wide source for background_folder.
+
+    background_folder defaults to the bank's own folder.
+    """
+    _banks[background_folder if background_folder is not None else bank.folder] = bank
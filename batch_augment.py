@@ -0,0 +1,136 @@
+import cv2
+import numpy as np
+
+# Batched versions of the pointwise transforms in augment.py.
+# Every function takes an (N, H, W, C) uint8 stack, draws per-sample parameters
+# from rng unless they are given, writes into `out` (which may be the input
+# stack itself for in-place operation) and returns (out, suffixes) where
+# suffixes has one entry per sample, like the per-image functions.
+
+def _check_batch(batch):
+    if batch.dtype != np.uint8 or batch.ndim != 4:
+        raise ValueError(f"Expected an (N, H, W, C) uint8 stack, got {batch.dtype} {batch.shape}")
+
+def _rng(rng):
+    # Fall back to the global np.random state so np.random.seed keeps runs reproducible
+    if rng is None:
+        rng = np.random.default_rng(np.random.randint(0, 2 ** 31))
+    return rng
+
+def _out(batch, out):
+    if out is None:
+        return np.empty_like(batch)
+    if out.shape != batch.shape or out.dtype != np.uint8:
+        raise ValueError(f"Output buffer {out.dtype} {out.shape} does not match batch {batch.shape}")
+    return out
+
+def _flat(batch):
+    # (N, H, W, ...) stack as one (N*H, W, ...) image, for OpenCV calls over the whole stack
+    return batch.reshape((-1,) + batch.shape[2:])
+
+def _per_sample(value, n):
+    return np.broadcast_to(np.asarray(value), (n,))
+
+def stack_images(images, out=None):
+    """Stack same-size images into an (N, H, W, C) uint8 array, reusing out if given."""
+    shape = images[0].shape
+    for image in images:
+        if image.shape != shape:
+            raise ValueError(f"Cannot stack images of different sizes: {shape} and {image.shape}")
+    if out is None:
+        out = np.empty((len(images),) + shape, np.uint8)
+    for i, image in enumerate(images):
+        out[i] = image
+    return out
+
+def batch_flip(batch, flip=None, out=None):
+    """Flip samples horizontally and vertically. flip is a per-sample bool mask (default: all)."""
+    _check_batch(batch)
+    out = _out(batch, out)
+    n = len(batch)
+    flip = [True] * n if flip is None else _per_sample(flip, n).tolist()
+    for i, flipped in enumerate(flip):
+        if flipped:
+            cv2.flip(batch[i], -1, dst=out[i])
+        elif out is not batch:
+            out[i] = batch[i]
+    return out, ["_flip" if flipped else "" for flipped in flip]
+
+def batch_brightness_contrast(batch, alpha=None, beta=None, rng=None, out=None):
+    """Adjust brightness and contrast with per-sample alpha and beta, like adjust_brightness_contrast."""
+    _check_batch(batch)
+    out = _out(batch, out)
+    n = len(batch)
+    rng = _rng(rng)
+    alpha = rng.uniform(0.8, 1.2, n) if alpha is None else _per_sample(alpha, n)
+    beta = rng.integers(-30, 31, n) if beta is None else _per_sample(beta, n)
+    if n and (alpha == alpha[0]).all() and (beta == beta[0]).all():
+        # One call over the whole stack
+        cv2.convertScaleAbs(_flat(batch), dst=_flat(out), alpha=float(alpha[0]), beta=float(beta[0]))
+    else:
+        for i, (a, b) in enumerate(zip(alpha.tolist(), beta.tolist())):
+            cv2.convertScaleAbs(batch[i], dst=out[i], alpha=a, beta=b)
+    return out, [f"_brightness_{a:.2f}_{b}" for a, b in zip(alpha.tolist(), beta.tolist())]
+
+def batch_gaussian_noise(batch, sigma=30, rng=None, out=None):
+    """Add Gaussian noise with a per-sample sigma, using one float32 scratch image."""
+    _check_batch(batch)
+    out = _out(batch, out)
+    n = len(batch)
+    rng = _rng(rng)
+    sigma = _per_sample(sigma, n)
+    scratch = np.empty(batch.shape[1:], np.float32)
+    for i in range(n):
+        rng.standard_normal(dtype=np.float32, out=scratch)
+        scratch *= sigma[i]
+        scratch += batch[i]
+        np.clip(scratch, 0, 255, out=scratch)
+        np.copyto(out[i], scratch, casting='unsafe')
+    return out, ["_gaussian_noise"] * n
+
+def batch_salt_pepper_noise(batch, amount=0.05, rng=None, out=None):
+    """Add salt-and-pepper noise with a per-sample amount, drawn like add_salt_pepper_noise.
+
+    Each sample gets ceil(amount * size / 2) salt and as many pepper pixels,
+    at positions drawn with replacement; all samples are written with one
+    scatter per colour.
+    """
+    _check_batch(batch)
+    out = _out(batch, out)
+    n, h, w, ch = batch.shape
+    rng = _rng(rng)
+    amount = _per_sample(amount, n)
+    if out is not batch:
+        np.copyto(out, batch)
+    # One element per pixel, so a scatter writes all channels at once
+    pixel = np.dtype((np.void, ch))
+    pixels = out.reshape(n * h * w, ch).view(pixel).reshape(-1)
+    counts = np.ceil(amount * h * w * ch * 0.5).astype(np.int64)
+    starts = np.repeat(np.arange(n, dtype=np.int64) * (h * w), counts)
+    for value in (255, 0):
+        # Like np.random.randint(0, i-1) in add_salt_pepper_noise, the last row and column are never hit
+        index = rng.integers(0, h - 1, len(starts)) * w + rng.integers(0, w - 1, len(starts)) + starts
+        pixels[index] = np.full(1, value, np.uint8).repeat(ch).view(pixel)[0]
+    return out, ["_salt_pepper"] * n
+
+def batch_hue_shift(batch, shift=None, rng=None, out=None):
+    """Shift the hue of BGR samples by a per-sample amount (in OpenCV's 0-179 hue units).
+
+    The colour conversions run once over the whole stack; only the hue
+    plane goes through a per-sample lookup table.
+    """
+    _check_batch(batch)
+    out = _out(batch, out)
+    n = len(batch)
+    rng = _rng(rng)
+    shift = rng.integers(0, 51, n) if shift is None else _per_sample(shift, n)
+    if n == 0:
+        return out, []
+    hsv = cv2.cvtColor(_flat(batch), cv2.COLOR_BGR2HSV)
+    hue = cv2.extractChannel(hsv, 0).reshape(batch.shape[:3])
+    luts = ((np.arange(256) + np.asarray(shift, np.int64)[:, None]) % 180).astype(np.uint8)
+    for i in range(n):
+        cv2.LUT(hue[i], luts[i], dst=hue[i])
+    cv2.insertChannel(_flat(hue), hsv, 0)
+    cv2.cvtColor(hsv, cv2.COLOR_HSV2BGR, dst=_flat(out))
+    return out, [f"_hue_shift_{shift[i]}" for i in range(n)]
@@ -0,0 +1,310 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from queue import Empty
+
+import cv2
+import numpy as np
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; peak RSS is then not reported
+    resource = None
+
+# Synthetic-data benchmark for every tool in the repo.
+#
+#   python benchmark.py --output bench.json
+#   python benchmark.py --output new.json --compare bench.json
+#
+# Each tool runs in a fresh process so its peak RSS is its own. Results are
+# written as JSON: throughput (items/s), per-call latency percentiles and
+# peak RSS per tool.
+
+TOOLS = ('augment', 'label_crop', 'yolo_to_torch_dataset', 'reformat_label', 'video2frame', 'frame2video')
+
+def make_dataset(root, images, sizes, categories, video_seconds, fps, seed=0):
+    """Write synthetic images, YOLO labels, backgrounds and a short video under root."""
+    rng = np.random.default_rng(seed)
+    for folder in ('images', 'labels', 'augment', 'background', 'frames'):
+        os.makedirs(os.path.join(root, folder), exist_ok=True)
+
+    for i in range(images):
+        w, h = sizes[i % len(sizes)]
+        image = rng.integers(0, 256, (h, w, 3), dtype=np.uint8)
+        cv2.rectangle(image, (w // 4, h // 4), (3 * w // 4, 3 * h // 4), (255, 255, 255), -1)
+        # Label file names follow reformat_label's <category>_<n>.txt convention
+        name = f"cat{i % categories}_{i:05d}"
+        cv2.imwrite(os.path.join(root, 'images', name + '.jpg'), image)
+        with open(os.path.join(root, 'labels', name + '.txt'), 'w') as f:
+            for _ in range(int(rng.integers(1, 5))):
+                bw, bh = rng.uniform(0.05, 0.5, 2)
+                xc, yc = rng.uniform(bw / 2, 1 - bw / 2), rng.uniform(bh / 2, 1 - bh / 2)
+                f.write(f"{int(rng.integers(0, 2))} {xc:.6f} {yc:.6f} {bw:.6f} {bh:.6f}\n")
+        # Small logo crops for augment
+        logo = cv2.resize(image, (max(16, w // 4), max(16, h // 4)))
+        cv2.imwrite(os.path.join(root, 'augment', name + '.png'), logo)
+        cv2.imwrite(os.path.join(root, 'frames', f"frame_{i:05d}.jpg"), cv2.resize(image, (320, 240)))
+
+    max_w = max(w for w, _ in sizes)
+    max_h = max(h for _, h in sizes)
+    for i in range(4):
+        background = rng.integers(0, 256, (max_h // 4 + 100, max_w // 4 + 100, 3), dtype=np.uint8)
+        cv2.imwrite(os.path.join(root, 'background', f"bg_{i}.jpg"), background)
+
+    video = cv2.VideoWriter(os.path.join(root, 'video.mp4'), cv2.VideoWriter_fourcc(*'mp4v'), fps, (320, 240))
+    frame = rng.integers(0, 256, (240, 320, 3), dtype=np.uint8)
+    for i in range(int(video_seconds * fps)):
+        video.write(np.roll(frame, i * 4, axis=1))
+    video.release()
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def latency_stats(latencies):
+    if not latencies:
+        return {}
+    values = np.array(latencies) * 1000
+    return {'calls': len(latencies), 'mean_ms': float(values.mean()),
+            'p50_ms': float(np.percentile(values, 50)), 'p90_ms': float(np.percentile(values, 90)),
+            'p99_ms': float(np.percentile(values, 99)), 'max_ms': float(values.max())}
+
+def quiet(func, *args, **kwargs):
+    """Call func with stdout discarded (the tools print a line per file)."""
+    stdout = sys.stdout
+    with open(os.devnull, 'w') as devnull:
+        sys.stdout = devnull
+        try:
+            return func(*args, **kwargs)
+        finally:
+            sys.stdout = stdout
+
+def bench_augment(root, work, workers):
+    import augment
+    from image_writer import AsyncImageWriter
+    source = os.path.join(root, 'augment')
+    folder = os.path.join(work, 'augment')
+    shutil.copytree(source, folder)
+    filenames = augment.list_images(folder)
+
+    _, seconds = timed(quiet, augment.augment_images_in_folder, folder, os.path.join(root, 'background'),
+                       workers=workers, seed=0)
+    latencies = []
+    serial_folder = os.path.join(work, 'augment_serial')
+    shutil.copytree(source, serial_folder)
+    with AsyncImageWriter() as writer:
+        for i, filename in enumerate(filenames):
+            _, latency = timed(augment.augment_file, filename, serial_folder, serial_folder,
+                               os.path.join(root, 'background'), i, writer=writer)
+            latencies.append(latency)
+    return {'unit': 'images', 'items': len(filenames), 'seconds': seconds,
+            'items_per_s': len(filenames) / seconds, 'latency': latency_stats(latencies)}
+
+def bench_label_crop(root, work, workers):
+    import label_crop
+    from file_utils import DATASET_IMAGE_EXTENSIONS, list_images
+    from image_writer import AsyncImageWriter
+    output = os.path.join(work, 'crops')
+    crops, seconds = timed(quiet, label_crop.crop_folder, root, output, workers=workers)
+    image_names = list_images(os.path.join(root, 'images'), DATASET_IMAGE_EXTENSIONS)
+    latencies = []
+    with AsyncImageWriter() as writer:
+        for image_name in image_names:
+            _, latency = timed(label_crop.crop_file, image_name, os.path.join(root, 'images'),
+                               os.path.join(root, 'labels'), output, writer=writer)
+            latencies.append(latency)
+    return {'unit': 'images', 'items': len(image_names), 'crops': crops, 'seconds': seconds,
+            'items_per_s': len(image_names) / seconds, 'latency': latency_stats(latencies)}
+
+def bench_reformat_label(root, work, workers):
+    import reformat_label
+    labels = os.path.join(root, 'labels')
+    files = len([f for f in os.listdir(labels) if f.endswith('.txt')])
+    output = os.path.join(work, 'new_labels')
+    _, cold = timed(quiet, reformat_label.reformat_labels, labels, output, os.path.join(work, 'classes.txt'),
+                    workers=workers)
+    latencies = []
+    for _ in range(5):
+        _, latency = timed(quiet, reformat_label.reformat_labels, labels, output,
+                           os.path.join(work, 'classes.txt'), workers=workers)
+        latencies.append(latency)
+    return {'unit': 'label files', 'items': files, 'seconds': cold, 'items_per_s': files / cold,
+            'incremental_items_per_s': files / min(latencies), 'latency': latency_stats(latencies)}
+
+def bench_yolo_to_torch_dataset(root, work, workers):
+    import reformat_label
+    from yolo_to_torch_dataset import YoloCropDataset
+    labels = os.path.join(work, 'new_labels')
+    classes = os.path.join(work, 'classes.txt')
+    quiet(reformat_label.reformat_labels, os.path.join(root, 'labels'), labels, classes)
+    (dataset, index_seconds) = timed(YoloCropDataset, os.path.join(root, 'images'), labels, classes)
+    latencies = []
+    start = time.perf_counter()
+    for i in range(len(dataset)):
+        _, latency = timed(dataset.__getitem__, i)
+        latencies.append(latency)
+    seconds = time.perf_counter() - start
+    return {'unit': 'crops', 'items': len(dataset), 'seconds': seconds, 'index_seconds': index_seconds,
+            'items_per_s': len(dataset) / seconds, 'latency': latency_stats(latencies)}
+
+def bench_video2frame(root, work, workers):
+    import video2frame
+    video = os.path.join(root, 'video.mp4')
+    vidcap = cv2.VideoCapture(video)
+    fps = vidcap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+    vidcap.release()
+
+    _, seconds = timed(quiet, video2frame.extract_frames, video, os.path.join(work, 'frames'), frame_rate=1)
+    latencies = []
+    frames = video2frame.iter_frames(video, frame_rate=fps)
+    while True:
+        start = time.perf_counter()
+        item = next(frames, None)
+        if item is None:
+            break
+        latencies.append(time.perf_counter() - start)
+    decode_seconds = sum(latencies)
+    return {'unit': 'video frames', 'items': total_frames, 'seconds': seconds,
+            'items_per_s': total_frames / seconds, 'decode_frames_per_s': len(latencies) / decode_seconds,
+            'latency': latency_stats(latencies)}
+
+def bench_frame2video(root, work, workers):
+    import frame2video
+    folder = os.path.join(root, 'frames')
+    frames = len(os.listdir(folder))
+    latencies = []
+    for i in range(3):
+        _, latency = timed(quiet, frame2video.frames_to_video, folder, os.path.join(work, f"video_{i}.mp4"), 25,
+                           workers=workers)
+        latencies.append(latency)
+    seconds = min(latencies)
+    return {'unit': 'frames', 'items': frames, 'seconds': seconds, 'items_per_s': frames / seconds,
+            'latency': latency_stats(latencies)}
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in KiB on Linux and bytes on macOS
+    scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return {'self': own / scale, 'children': children / scale}
+
+def run_tool(tool, root, workers, results, stages=False):
+    """Run one benchmark in this (fresh) process and put its result on the results queue.
+
+    With stages, per-stage timings from the instrument module are added to the result.
+    """
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import instrument
+    if stages:
+        instrument.enable()
+    work = tempfile.mkdtemp(prefix=f"bench_{tool}_")
+    try:
+        result = globals()[f"bench_{tool}"](root, work, workers)
+        result['peak_rss_mb'] = peak_rss_mb()
+        if stages:
+            result['stages'] = instrument.summary()
+        results.put((tool, result))
+    except Exception as error:
+        results.put((tool, {'error': repr(error)}))
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+
+def wait_for_result(process, results):
+    """Return the result run_tool puts on results, or an error entry if its process dies without one."""
+    while True:
+        try:
+            return results.get(timeout=1)[1]
+        except Empty:
+            if process.is_alive():
+                continue
+        # The process may have put its result just before exiting
+        try:
+            return results.get(timeout=1)[1]
+        except Empty:
+            return {'error': f"benchmark process exited with code {process.exitcode} without a result"}
+
+def print_summary(results, baseline=None):
+    print(f"{'tool':<24}{'items/s':>12}{'p50 ms':>10}{'p99 ms':>10}{'peak RSS MB':>13}{'vs baseline':>13}")
+    for tool, result in results.items():
+        if 'error' in result:
+            print(f"{tool:<24}error: {result['error']}")
+            continue
+        rss = result['peak_rss_mb']
+        rss = f"{max(rss.values()):.0f}" if rss else '-'
+        change = '-'
+        if baseline and tool in baseline and 'items_per_s' in baseline[tool]:
+            change = f"{result['items_per_s'] / baseline[tool]['items_per_s']:.2f}x"
+        latency = result['latency']
+        print(f"{tool:<24}{result['items_per_s']:>12.1f}{latency.get('p50_ms', 0):>10.2f}"
+              f"{latency.get('p99_ms', 0):>10.2f}{rss:>13}{change:>13}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the repo's tools on synthetic data.")
+    parser.add_argument('--output', default='bench.json', help='JSON file to write the results to')
+    parser.add_argument('--compare', help='earlier results JSON to compare throughput against')
+    parser.add_argument('--tools', nargs='+', choices=TOOLS, default=list(TOOLS))
+    parser.add_argument('--images', type=int, default=200)
+    parser.add_argument('--sizes', nargs='+', default=['320x240', '640x480', '1280x720'],
+                        help='image sizes as WIDTHxHEIGHT, used in rotation')
+    parser.add_argument('--categories', type=int, default=10)
+    parser.add_argument('--video-seconds', type=float, default=20)
+    parser.add_argument('--fps', type=float, default=25)
+    parser.add_argument('--workers', type=int, default=os.cpu_count())
+    parser.add_argument('--stages', action='store_true', help='also record per-stage timings (instrument module)')
+    parser.add_argument('--data', help='reuse/keep the synthetic dataset in this folder')
+    args = parser.parse_args()
+
+    sizes = [tuple(int(v) for v in size.split('x')) for size in args.sizes]
+    root = args.data or tempfile.mkdtemp(prefix='bench_data_')
+    if not os.path.exists(os.path.join(root, 'video.mp4')):
+        print(f"Generating synthetic data in {root}")
+        make_dataset(root, args.images, sizes, args.categories, args.video_seconds, args.fps)
+
+    context = multiprocessing.get_context('spawn')
+    results = {}
+    try:
+        for tool in args.tools:
+            print(f"Running {tool}...")
+            queue = context.Queue()
+            process = context.Process(target=run_tool, args=(tool, root, args.workers, queue, args.stages))
+            process.start()
+            results[tool] = wait_for_result(process, queue)
+            process.join()
+    finally:
+        if args.data is None:
+            shutil.rmtree(root, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'opencv': cv2.__version__,
+            'numpy': np.__version__,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': vars(args),
+        },
+        'results': results,
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, 'r') as f:
+            baseline = json.load(f)['results']
+    print_summary(results, baseline)
+    print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,25 @@
+import json
+import os
+
+import instrument
+
+# Images the tools read from plain folders (augment inputs, backgrounds, frames)
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tiff')
+# Images of a YOLO dataset (an images/ folder next to labels/)
+DATASET_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+def list_images(folder_path, extensions=IMAGE_EXTENSIONS):
+    """Return the sorted image filenames in a folder."""
+    with instrument.stage('listdir'):
+        return sorted(filename for filename in os.listdir(folder_path)
+                      if filename.lower().endswith(extensions))
+
+def save_json(data, path, **kwargs):
+    """Write data to path as JSON, through a temporary file, so readers never see a partial file.
+
+    kwargs are passed to json.dump.
+    """
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f, **kwargs)
+    os.replace(tmp_path, path)
@@ -1,41 +1,181 @@
 import cv2
+import itertools
 import os
+import re
+import shutil
+import subprocess
+import tempfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 
-def frames_to_video(input_folder, output_file, fps, target_width=None, target_height=None):
-    images = [img for img in os.listdir(input_folder) if img.endswith(".png") or img.endswith(".jpg")]
-    images.sort()  
-    
-    first_image_path = os.path.join(input_folder, images[0])
-    frame = cv2.imread(first_image_path)
-    original_height, original_width, layers = frame.shape
+import instrument
+
+def natural_sort_key(filename):
+    """Sort key that orders frame_2.jpg before frame_10.jpg."""
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', filename)]
+
+def ordered_map(func, items, workers, prefetch):
+    """Like map(func, items), but run on a thread pool with up to prefetch results in flight, in order."""
+    if workers <= 0:
+        yield from map(func, items)
+        return
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= prefetch:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+def frames_to_video(input_folder, output_file, fps, target_width=None, target_height=None,
+                    workers=4, prefetch=16, natural_sort=False, repeat_stills=True):
+    """Write frames to a video.
+
+    input_folder is either a folder of .png/.jpg frames, used in sorted order
+    (natural order with natural_sort, so frame_2 comes before frame_10), or an
+    iterable of (frame_id, frame) pairs such as video2frame.iter_frames.
+
+    Frames are decoded and resized on `workers` threads, up to `prefetch`
+    ahead of the encoder; workers=0 does everything on the calling thread.
+
+    For fps < 1 each frame is shown for 1/fps seconds. By default this is done
+    by writing it int(1/fps) times into a 1 fps video; with repeat_stills=False
+    the video is written at the fractional frame rate instead, so every frame
+    is encoded once and non-integer durations such as 2.5 s come out exact.
+    """
+    if isinstance(input_folder, (str, os.PathLike)):
+        with instrument.stage('listdir'):
+            images = [img for img in os.listdir(input_folder) if img.endswith(".png") or img.endswith(".jpg")]
+        images.sort(key=natural_sort_key if natural_sort else None)
+        if not images:
+            print("Error: No frames to write.")
+            return
+        first = cv2.imread(os.path.join(input_folder, images[0]))
+        rest = (os.path.join(input_folder, image) for image in images[1:])
+    else:
+        rest = (frame for _, frame in input_folder)
+        first = next(rest, None)
+        if first is None:
+            print("Error: No frames to write.")
+            return
+    original_height, original_width = first.shape[:2]
 
     if target_width is None or target_height is None:
         target_width = original_width
         target_height = original_height
 
-    fourcc = cv2.VideoWriter_fourcc(*'mp4v')  
-    video = cv2.VideoWriter(output_file, fourcc, max(fps, 1), (target_width, target_height))
+    write_video(itertools.chain([first], rest), output_file, fps, target_width, target_height, workers, prefetch,
+                repeat_stills)
+    print(f"Video saved as {output_file}")
 
-    if fps >= 1:
-        for image in images:
-            frame = cv2.imread(os.path.join(input_folder, image))
-            frame_resized = cv2.resize(frame, (target_width, target_height))
-            video.write(frame_resized)
+def write_video(sources, output_file, fps, target_width, target_height, workers=4, prefetch=16,
+                repeat_stills=True):
+    """Resize and encode sources into output_file; fps and repeat_stills work as in frames_to_video.
+
+    Each source is an image path or an already decoded frame. Paths are
+    decoded, and all frames resized, on `workers` threads, up to `prefetch`
+    ahead of the encoder.
+    """
+    def prepare(source):
+        if isinstance(source, (str, os.PathLike)):
+            with instrument.stage('imread', path=source):
+                source = cv2.imread(os.fspath(source))
+        with instrument.stage('resize'):
+            return cv2.resize(source, (target_width, target_height))
+
+    if fps >= 1 or not repeat_stills:
+        writer_fps, frame_repeat_count = fps, 1
     else:
-        frame_repeat_count = int(1 / fps)
-        for image in images:
-            frame = cv2.imread(os.path.join(input_folder, image))
-            frame_resized = cv2.resize(frame, (target_width, target_height))
+        writer_fps, frame_repeat_count = 1, int(1 / fps)
+
+    fourcc = cv2.VideoWriter_fourcc(*'mp4v')  
+    video = cv2.VideoWriter(output_file, fourcc, writer_fps, (target_width, target_height))
+
+    progress = instrument.Progress(label='frames')
+    for frame_resized in ordered_map(prepare, sources, workers, prefetch):
+        with instrument.stage('video_encode'):
             for _ in range(frame_repeat_count):
                 video.write(frame_resized)
+        progress.update()
     video.release()
+    progress.close()
+
+def encode_chunk(image_paths, segment_file, fps, target_width, target_height, repeat_stills):
+    """Encode one chunk of frames to its own segment file. Runs in worker processes."""
+    # Paths go to the thread pool, so frames are decoded there in parallel
+    write_video(image_paths, segment_file, fps, target_width, target_height, workers=2,
+                repeat_stills=repeat_stills)
+    return segment_file
+
+def frames_to_video_parallel(input_folder, output_file, fps, target_width=None, target_height=None,
+                             workers=None, natural_sort=False, repeat_stills=True, ffmpeg='ffmpeg'):
+    """Like frames_to_video, but encode chunks of the frame list in parallel processes.
+
+    Each chunk is encoded to a temporary segment and the segments are joined
+    into output_file with ffmpeg's concat demuxer without re-encoding (ffmpeg
+    must be installed). The frame count and duration of the result are
+    checked against what a serial encode would produce.
+    """
+    ffmpeg_path = shutil.which(ffmpeg)
+    if ffmpeg_path is None:
+        raise RuntimeError(f"ffmpeg not found ({ffmpeg}); it is needed to join the encoded segments")
+    images = [img for img in os.listdir(input_folder) if img.endswith(".png") or img.endswith(".jpg")]
+    images.sort(key=natural_sort_key if natural_sort else None)
+    if not images:
+        print("Error: No frames to write.")
+        return
+    image_paths = [os.path.join(input_folder, image) for image in images]
+    if target_width is None or target_height is None:
+        target_height, target_width = cv2.imread(image_paths[0]).shape[:2]
+
+    workers = workers or os.cpu_count()
+    chunk_size = -(-len(image_paths) // workers)
+    chunks = [image_paths[i:i + chunk_size] for i in range(0, len(image_paths), chunk_size)]
+
+    temp_dir = tempfile.mkdtemp(prefix='frames_to_video_', dir=os.path.dirname(os.path.abspath(output_file)))
+    try:
+        segment_files = [os.path.join(temp_dir, f"segment_{i:05d}.mp4") for i in range(len(chunks))]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            task = instrument.worker_task(encode_chunk)
+            results = executor.map(task, chunks, segment_files, itertools.repeat(fps),
+                                   itertools.repeat(target_width), itertools.repeat(target_height),
+                                   itertools.repeat(repeat_stills))
+            for result in results:
+                instrument.task_result(result)
+
+        list_file = os.path.join(temp_dir, 'segments.txt')
+        with open(list_file, 'w') as f:
+            for segment_file in segment_files:
+                escaped = segment_file.replace("'", "'\\''")
+                f.write(f"file '{escaped}'\n")
+        with instrument.stage('concat_segments'):
+            subprocess.run([ffmpeg_path, '-y', '-v', 'error', '-f', 'concat', '-safe', '0', '-i', list_file,
+                            '-c', 'copy', output_file], check=True)
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    # A serial encode writes every frame frame_repeat_count times at writer_fps
+    if fps >= 1 or not repeat_stills:
+        writer_fps, frame_repeat_count = fps, 1
+    else:
+        writer_fps, frame_repeat_count = 1, int(1 / fps)
+    expected_frames = len(image_paths) * frame_repeat_count
+    vidcap = cv2.VideoCapture(output_file)
+    frame_count = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+    output_fps = vidcap.get(cv2.CAP_PROP_FPS)
+    vidcap.release()
+    if frame_count != expected_frames or abs(output_fps - writer_fps) > 0.01 * writer_fps:
+        raise RuntimeError(f"{output_file} has {frame_count} frames at {output_fps} fps, "
+                           f"expected {expected_frames} frames at {writer_fps} fps")
 
     print(f"Video saved as {output_file}")
 
-input_folder = 'frameinput'
-output_file = 'output_video.mp4'
-fps = 0.5  # 2 sec per frame
-target_width = 640  # Resize all frames to width 640
-target_height = 480  # Resize all frames to height 480
+if __name__ == '__main__':
+    input_folder = 'frameinput'
+    output_file = 'output_video.mp4'
+    fps = 0.5  # 2 sec per frame
+    target_width = 640  # Resize all frames to width 640
+    target_height = 480  # Resize all frames to height 480
 
-frames_to_video(input_folder, output_file, fps, target_width, target_height)
+    frames_to_video(input_folder, output_file, fps, target_width, target_height)
@@ -0,0 +1,97 @@
+import os
+import queue
+import threading
+
+import cv2
+
+import instrument
+from file_utils import IMAGE_EXTENSIONS
+from image_writer import AsyncImageWriter
+
+# Helpers for chaining video2frame, augment and frame2video in one process.
+# Stages exchange iterators of (frame_id, ndarray) pairs instead of folders of
+# encoded images; frames only touch the disk through read_frames/save_frames.
+#
+#   frames = iter_frames('video/in.mp4', frame_rate=1)            # video2frame
+#   frames = prefetch(augment_frames(frames, 'background'))        # augment
+#   frames_to_video(frames, 'augmented.mp4', fps=2)                # frame2video
+
+_END = object()
+
+def prefetch(iterable, size=8):
+    """Run iterable in a background thread, keeping at most size items buffered ahead.
+
+    Exceptions raised by the producer are re-raised in the consumer. If the
+    consumer stops early, the producer thread exits and closes iterable (so
+    e.g. iter_frames releases its video) instead of blocking on a full buffer.
+    """
+    buffer = queue.Queue(maxsize=size)
+    stop = threading.Event()
+    source = iter(iterable)
+
+    def put(item):
+        # Returns False once the consumer has gone away
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for item in source:
+                if not put(item):
+                    return
+            put(_END)
+        except BaseException as error:
+            put(error)
+        finally:
+            close = getattr(source, 'close', None)
+            if close is not None:
+                close()
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is _END:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        # The consumer stopped early (or finished); let the producer exit
+        stop.set()
+
+def read_frames(folder, extensions=IMAGE_EXTENSIONS):
+    """Yield (filename without extension, image) for the images in a folder, in sorted order."""
+    for filename in sorted(os.listdir(folder)):
+        if filename.lower().endswith(extensions):
+            path = os.path.join(folder, filename)
+            with instrument.stage('imread', path=path):
+                image = cv2.imread(path)
+            if image is None:
+                print(f"Failed to load image: {path}")
+                continue
+            yield os.path.splitext(filename)[0], image
+
+def save_frames(frames, output_folder, prefix='frame', ext='.jpg', writer=None):
+    """Write (frame_id, image) pairs as output_folder/<prefix>_<frame_id><ext>. Returns the paths."""
+    os.makedirs(output_folder, exist_ok=True)
+    own_writer = writer is None
+    if own_writer:
+        writer = AsyncImageWriter()
+    paths = []
+    try:
+        for frame_id, image in frames:
+            name = f"{prefix}_{frame_id:04d}" if isinstance(frame_id, int) else f"{prefix}_{frame_id}"
+            paths.append(writer.write(os.path.join(output_folder, name + ext), image))
+    finally:
+        if own_writer:
+            writer.close()
+        else:
+            writer.flush()
+    return paths
@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+
+class LRUImageCache:
+    """Least-recently-used cache of decoded images, bounded by total bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def __getstate__(self):
+        # Pickled (e.g. into DataLoader workers) as an empty cache of the same size; the lock can't be pickled
+        return {'max_bytes': self.max_bytes}
+
+    def __setstate__(self, state):
+        self.__init__(state['max_bytes'])
+
+    def get(self, key):
+        """Return the cached image for key (marking it recently used) or None."""
+        with self._lock:
+            image = self._items.get(key)
+            if image is not None:
+                self._items.move_to_end(key)
+            return image
+
+    def put(self, key, image):
+        """Cache image under key, evicting the least recently used images to stay under max_bytes."""
+        if image is None or image.nbytes > self.max_bytes:
+            return image
+        # Cached images are shared between callers, so they must not be modified in place
+        image.flags.writeable = False
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._items[key] = image
+            self.nbytes += image.nbytes
+            while self.nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self.nbytes = 0
@@ -0,0 +1,158 @@
+import io
+import json
+import os
+import struct
+
+import cv2
+
+from file_utils import save_json
+
+def _tiff_tags(f, wanted):
+    """Read the wanted tags from the first IFD of a TIFF structure starting at offset 0 of file f."""
+    header = f.read(8)
+    if header[:4] == b'II*\x00':
+        endian = '<'
+    elif header[:4] == b'MM\x00*':
+        endian = '>'
+    else:
+        return {}
+    # The IFD can be anywhere; libtiff (and so cv2.imwrite) puts it after the image data
+    f.seek(struct.unpack(endian + 'I', header[4:8])[0])
+    count_bytes = f.read(2)
+    if len(count_bytes) < 2:
+        return {}
+    count = struct.unpack(endian + 'H', count_bytes)[0]
+    table = f.read(count * 12)
+    values = {}
+    for i in range(count):
+        entry = table[i * 12:i * 12 + 12]
+        if len(entry) < 12:
+            break
+        tag, value_type = struct.unpack(endian + 'HH', entry[:4])
+        if tag not in wanted:
+            continue
+        if value_type == 3:  # SHORT
+            values[tag] = struct.unpack(endian + 'H', entry[8:10])[0]
+        elif value_type == 4:  # LONG
+            values[tag] = struct.unpack(endian + 'I', entry[8:12])[0]
+    return values
+
+def _probe_png(f):
+    header = f.read(24)
+    if len(header) < 24 or header[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', header[16:24])
+
+def _probe_bmp(f):
+    header = f.read(26)
+    if len(header) < 26:
+        return None
+    dib_size = struct.unpack('<I', header[14:18])[0]
+    if dib_size == 12:
+        return struct.unpack('<HH', header[18:22])
+    width, height = struct.unpack('<ii', header[18:26])
+    return width, abs(height)
+
+def _probe_tiff(f):
+    tags = _tiff_tags(f, (256, 257))
+    if 256 not in tags or 257 not in tags:
+        return None
+    return tags[256], tags[257]
+
+def _probe_jpeg(f):
+    f.read(2)
+    orientation = 1
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        code = marker[1]
+        if code == 0xFF:
+            f.seek(-1, os.SEEK_CUR)
+            continue
+        if code == 0x01 or 0xD0 <= code <= 0xD7:
+            continue
+        if code == 0xD9:
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length = struct.unpack('>H', length_bytes)[0]
+        if 0xC0 <= code <= 0xCF and code not in (0xC4, 0xC8, 0xCC):
+            segment = f.read(5)
+            if len(segment) < 5:
+                return None
+            height, width = struct.unpack('>HH', segment[1:5])
+            # cv2.imread applies the EXIF orientation, which swaps the axes for 5-8
+            if orientation in (5, 6, 7, 8):
+                width, height = height, width
+            return width, height
+        if code == 0xE1:
+            segment = f.read(length - 2)
+            if segment[:6] == b'Exif\x00\x00':
+                orientation = _tiff_tags(io.BytesIO(segment[6:]), (0x0112,)).get(0x0112, orientation)
+            continue
+        f.seek(length - 2, os.SEEK_CUR)
+
+def probe_image_size(image_path):
+    """Return (width, height) of an image by reading only its header, or None if unknown.
+
+    Supports PNG, JPEG, BMP and TIFF.
+    """
+    try:
+        with open(image_path, 'rb') as f:
+            signature = f.read(8)
+            f.seek(0)
+            if signature == b'\x89PNG\r\n\x1a\n':
+                return _probe_png(f)
+            if signature[:2] == b'\xff\xd8':
+                return _probe_jpeg(f)
+            if signature[:2] == b'BM':
+                return _probe_bmp(f)
+            if signature[:4] in (b'II*\x00', b'MM\x00*'):
+                return _probe_tiff(f)
+    except (OSError, struct.error):
+        pass
+    return None
+
+def image_size(image_path):
+    """Return (width, height) of an image, decoding it only if the header cannot be parsed."""
+    size = probe_image_size(image_path)
+    if size is None:
+        image = cv2.imread(image_path)
+        if image is None:
+            return None
+        size = (image.shape[1], image.shape[0])
+    return size
+
+def image_sizes(image_paths, manifest_path=None):
+    """Return {path: (width, height)} for image_paths, using a persistent manifest.
+
+    The manifest stores the size and mtime of each file next to its dimensions,
+    so only new or changed files are probed. Unreadable images are left out.
+    """
+    manifest = {}
+    if manifest_path is not None and os.path.exists(manifest_path):
+        try:
+            with open(manifest_path, 'r') as f:
+                manifest = json.load(f)
+        except ValueError:
+            manifest = {}
+
+    sizes = {}
+    updated = {}
+    changed = False
+    for image_path in image_paths:
+        st = os.stat(image_path)
+        entry = manifest.get(image_path)
+        if entry is None or entry[0] != st.st_size or entry[1] != st.st_mtime_ns:
+            size = image_size(image_path)
+            entry = [st.st_size, st.st_mtime_ns] + (list(size) if size else [None, None])
+            changed = True
+        updated[image_path] = entry
+        if entry[2] is not None:
+            sizes[image_path] = (entry[2], entry[3])
+
+    if manifest_path is not None and (changed or len(updated) != len(manifest)):
+        save_json(updated, manifest_path)
+    return sizes
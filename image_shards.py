@@ -0,0 +1,144 @@
+import glob
+import io
+import json
+import mmap
+import os
+import threading
+
+import cv2
+import numpy as np
+
+import instrument
+from image_writer import AsyncImageWriter, encode_for_path
+
+class ShardWriter(AsyncImageWriter):
+    """AsyncImageWriter that appends encoded images to size-capped shard files.
+
+    Records go to <folder>/<prefix>-NNNNN.shard and each shard has a JSON-lines
+    index <prefix>-NNNNN.idx with one {"name", "offset", "length", "meta"}
+    entry per record, written as soon as the record is appended. A new shard
+    is started once max_shard_bytes would be exceeded. Shard numbers are
+    claimed with exclusive file creation, so several processes (or later
+    runs) can write into the same folder.
+    """
+
+    def __init__(self, folder, prefix='images', max_shard_bytes=1024 ** 3, **options):
+        super().__init__(**options)
+        self.folder = folder
+        self.prefix = prefix
+        self.max_shard_bytes = max_shard_bytes
+        os.makedirs(folder, exist_ok=True)
+        self._shard_lock = threading.Lock()
+        self._data_file = None
+        self._index_file = None
+        self._shard_size = 0
+        self.shard_path = None
+
+    def _open_shard(self):
+        self._close_shard()
+        n = 0
+        while True:
+            path = os.path.join(self.folder, f"{self.prefix}-{n:05d}.shard")
+            try:
+                fd = os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o644)
+                break
+            except FileExistsError:
+                n += 1
+        self.shard_path = path
+        self._data_file = os.fdopen(fd, 'wb')
+        self._index_file = open(os.path.splitext(path)[0] + '.idx', 'w')
+        self._shard_size = 0
+
+    def _close_shard(self):
+        if self._data_file is not None:
+            self._data_file.close()
+            self._index_file.close()
+            self._data_file = self._index_file = None
+
+    def _save(self, path, image, meta):
+        with instrument.stage('encode'):
+            data = encode_for_path(path, image, self.jpeg_quality, self.png_compression)
+        with instrument.stage('shard_write', nbytes=len(data)), self._shard_lock:
+            if self._data_file is None or (self._shard_size > 0 and
+                                           self._shard_size + len(data) > self.max_shard_bytes):
+                self._open_shard()
+            record = {'name': os.path.basename(path), 'offset': self._shard_size,
+                      'length': len(data), 'meta': meta or {}}
+            self._data_file.write(data)
+            self._index_file.write(json.dumps(record) + '\n')
+            self._shard_size += len(data)
+
+    def flush(self):
+        """Wait for queued images and flush the current shard and its index to disk."""
+        try:
+            super().flush()
+        finally:
+            with self._shard_lock:
+                if self._data_file is not None:
+                    self._data_file.flush()
+                    self._index_file.flush()
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            with self._shard_lock:
+                self._close_shard()
+
+class ShardReader:
+    """Random access and sequential iteration over shards written by ShardWriter.
+
+    Shard files are memory-mapped; reader[i] returns (name, meta, encoded bytes)
+    and decode(i) the image.
+    """
+
+    def __init__(self, folder, prefix='images'):
+        self.records = []
+        self.shards = []
+        for index_path in sorted(glob.glob(os.path.join(glob.escape(folder), f"{glob.escape(prefix)}-*.idx"))):
+            shard_id = len(self.shards)
+            self.shards.append(os.path.splitext(index_path)[0] + '.shard')
+            with open(index_path, 'r') as f:
+                for line in f:
+                    # A crash can leave a truncated last line
+                    if line.endswith('\n'):
+                        record = json.loads(line)
+                        self.records.append((shard_id, record['offset'], record['length'],
+                                             record['name'], record['meta']))
+        self._maps = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def _map(self, shard_id):
+        shard_map = self._maps.get(shard_id)
+        if shard_map is None:
+            with open(self.shards[shard_id], 'rb') as f:
+                shard_map = self._maps[shard_id] = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return shard_map
+
+    def __getitem__(self, i):
+        shard_id, offset, length, name, meta = self.records[i]
+        return name, meta, self._map(shard_id)[offset:offset + length]
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def decode(self, i):
+        """Decode record i into an image (or the stored array for .npy records)."""
+        name, _, data = self[i]
+        if name.lower().endswith('.npy'):
+            return np.load(io.BytesIO(data))
+        return cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+
+    def close(self):
+        for shard_map in self._maps.values():
+            shard_map.close()
+        self._maps = {}
+
+def open_writer(shard_folder=None, shard_prefix='images', max_shard_bytes=1024 ** 3, **options):
+    """Return a ShardWriter if shard_folder is given, otherwise a plain AsyncImageWriter."""
+    if shard_folder is not None:
+        return ShardWriter(shard_folder, shard_prefix, max_shard_bytes, **options)
+    return AsyncImageWriter(**options)
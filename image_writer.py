@@ -0,0 +1,135 @@
+import io
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import cv2
+import numpy as np
+
+import instrument
+
+def encode_params(ext, jpeg_quality=None, png_compression=None):
+    """cv2.imencode parameters for ext. None keeps OpenCV's defaults."""
+    ext = ext.lower()
+    if ext in ('.jpg', '.jpeg') and jpeg_quality is not None:
+        return [cv2.IMWRITE_JPEG_QUALITY, int(jpeg_quality)]
+    if ext == '.png' and png_compression is not None:
+        return [cv2.IMWRITE_PNG_COMPRESSION, int(png_compression)]
+    return []
+
+def encode_image(image, ext, jpeg_quality=None, png_compression=None):
+    """Encode image to bytes in the format given by ext ('.jpg', '.png', ...)."""
+    success, buffer = cv2.imencode(ext, image, encode_params(ext, jpeg_quality, png_compression))
+    if not success:
+        raise ValueError(f"Could not encode image as {ext}")
+    return buffer.tobytes()
+
+def encode_for_path(path, image, jpeg_quality=None, png_compression=None):
+    """Encode image in the format given by path's extension; .npy gives raw NumPy data."""
+    ext = os.path.splitext(path)[1]
+    if ext.lower() == '.npy':
+        buffer = io.BytesIO()
+        np.save(buffer, image)
+        return buffer.getvalue()
+    return encode_image(image, ext, jpeg_quality, png_compression)
+
+def save_image(path, image, jpeg_quality=None, png_compression=None):
+    """Write image to path, as raw NumPy data if path ends with .npy."""
+    with instrument.stage('encode'):
+        data = encode_for_path(path, image, jpeg_quality, png_compression)
+    with instrument.stage('imwrite', nbytes=len(data)):
+        with open(path, 'wb') as f:
+            f.write(data)
+
+class AsyncImageWriter:
+    """Write-behind image writer: a bounded queue feeding a pool of encoder threads.
+
+    write() returns as soon as the image is queued and blocks only when
+    max_pending images are already waiting, so compute overlaps with encoding
+    and disk I/O without unbounded memory growth. Queued images must not be
+    modified by the caller afterwards.
+
+    image_format ('jpg', 'png', 'npy', ...) replaces the extension of every
+    written path; None keeps the extension the caller asked for. 'npy' skips
+    encoding entirely. With workers=0 images are written synchronously.
+    """
+
+    def __init__(self, workers=4, max_pending=64, image_format=None, jpeg_quality=None, png_compression=None):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.image_format = image_format
+        self.jpeg_quality = jpeg_quality
+        self.png_compression = png_compression
+        self._executor = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._error = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def output_path(self, path):
+        """Path that write() actually writes for path, after applying image_format."""
+        if self.image_format is None:
+            return path
+        return os.path.splitext(path)[0] + '.' + self.image_format.lstrip('.')
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+            if future.exception() is not None and self._error is None:
+                self._error = future.exception()
+        self._slots.release()
+
+    def _save(self, path, image, meta):
+        save_image(path, image, self.jpeg_quality, self.png_compression)
+
+    def write(self, path, image, meta=None):
+        """Queue image to be written to path. Returns the output path.
+
+        meta (a JSON-serialisable dict) is ignored here and stored by ShardWriter.
+        """
+        path = self.output_path(path)
+        self._raise_error()
+        if self._executor is None:
+            self._save(path, image, meta)
+            return path
+        with instrument.stage('writer_wait'):
+            self._slots.acquire()
+        future = self._executor.submit(self._save, path, image, meta)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return path
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def flush(self):
+        """Wait until every queued image is on disk. Raises the first write error, if any."""
+        while True:
+            with self._lock:
+                pending = list(self._pending)
+            if not pending:
+                break
+            wait(pending)
+            with self._lock:
+                for future in pending:
+                    self._pending.discard(future)
+                    if future.exception() is not None and self._error is None:
+                        self._error = future.exception()
+        self._raise_error()
+
+    def close(self):
+        """Flush and stop the encoder threads."""
+        try:
+            self.flush()
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
@@ -0,0 +1,222 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+
+# Per-stage timing and counters for the hot paths of the tools.
+#
+#   import instrument
+#   instrument.enable(trace_path='trace.jsonl')   # optional sampled trace (workers: trace.jsonl.<pid>)
+#   augment_images_in_folder(...)
+#   instrument.report('stages.json')              # table on stdout, JSON file
+#
+# While disabled, stage() returns a shared no-op context manager, so the cost
+# at each call site is one function call and a flag check. While enabled,
+# per-file log() lines are suppressed in favour of a rate-limited Progress line.
+
+_enabled = False
+_in_worker = False  # Set in pool workers, which leave the progress line to the parent
+_lock = threading.Lock()
+_stats = {}  # stage name -> [calls, seconds, bytes]
+_trace_file = None
+_trace_path = None
+_trace_pid = None
+_trace_counts = {}  # stage name -> calls in this process, kept across reset() so workers sample evenly
+_inherited_trace_file = None  # The parent's trace file in a forked worker, kept open but unused
+_trace_every = 100
+
+def enable(trace_path=None, trace_every=100):
+    """Start collecting stage stats. With trace_path, every trace_every-th call of each stage
+    is also appended to trace_path as a JSON line; pool workers started through worker_task()
+    append theirs to trace_path.<pid>."""
+    global _enabled, _trace_file, _trace_path, _trace_pid, _trace_every
+    _enabled = True
+    _trace_every = max(1, int(trace_every))
+    if trace_path is not None and _trace_file is None:
+        # Line-buffered, so a forked pool worker never inherits unwritten trace lines
+        _trace_file = open(trace_path, 'a', buffering=1)
+        _trace_path = trace_path
+        _trace_pid = os.getpid()
+
+def disable():
+    global _enabled, _trace_file, _trace_path
+    _enabled = False
+    if _trace_file is not None:
+        _trace_file.close()
+        _trace_file = None
+        _trace_path = None
+
+def enabled():
+    return _enabled
+
+def reset():
+    """Clear the collected stats and return them."""
+    global _stats
+    with _lock:
+        stats, _stats = _stats, {}
+    return stats
+
+def record(name, seconds=0.0, nbytes=0, calls=1):
+    """Add calls, seconds and bytes to a stage. Does nothing while disabled."""
+    if not _enabled:
+        return
+    with _lock:
+        entry = _stats.get(name)
+        if entry is None:
+            entry = _stats[name] = [0, 0.0, 0]
+        entry[0] += calls
+        entry[1] += seconds
+        entry[2] += nbytes
+        if _trace_file is None:
+            return
+        count = _trace_counts[name] = _trace_counts.get(name, 0) + calls
+        if count % _trace_every == 0:
+            _trace_file.write(json.dumps({'stage': name, 'time': time.time(), 'seconds': seconds,
+                                          'bytes': nbytes, 'pid': os.getpid(),
+                                          'thread': threading.current_thread().name}) + '\n')
+
+class _Stage:
+    __slots__ = ('name', 'nbytes', 'path', 'start')
+
+    def __init__(self, name, nbytes, path):
+        self.name = name
+        self.nbytes = nbytes
+        self.path = path
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        seconds = time.perf_counter() - self.start
+        if self.path is not None:
+            try:
+                self.nbytes += os.path.getsize(self.path)
+            except OSError:
+                pass
+        record(self.name, seconds, self.nbytes)
+
+class _NullStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+def stage(name, nbytes=0, path=None):
+    """Context manager timing one call of a stage.
+
+    nbytes is added to the stage's byte count, and so is the size of the file
+    at path (read or written inside the block) when it exits.
+    """
+    if not _enabled:
+        return _NULL_STAGE
+    return _Stage(name, nbytes, path)
+
+def merge(stats):
+    """Add stats returned by reset() (e.g. from a worker process) to this process's stats."""
+    with _lock:
+        for name, (calls, seconds, nbytes) in stats.items():
+            entry = _stats.setdefault(name, [0, 0.0, 0])
+            entry[0] += calls
+            entry[1] += seconds
+            entry[2] += nbytes
+
+def _call_with_stats(trace_path, trace_every, func, *args, **kwargs):
+    global _trace_file, _inherited_trace_file, _in_worker
+    _in_worker = True
+    if _trace_file is not None and _trace_pid != os.getpid():
+        # A forked worker must not write to (or close) the parent's trace file
+        _inherited_trace_file, _trace_file = _trace_file, None
+    # Opened once per worker, on its first task
+    enable(trace_path and f"{trace_path}.{os.getpid()}", trace_every)
+    reset()
+    result = func(*args, **kwargs)
+    return result, reset()
+
+def worker_task(func):
+    """Wrap a process-pool task so the stats it records come back with its result.
+
+    Returns func unchanged while disabled. Results of the wrapped task must be
+    passed through task_result() in the parent. While tracing, each worker
+    writes its samples to its own file, <trace_path>.<pid>.
+    """
+    if not _enabled:
+        return func
+    if _trace_file is not None:
+        _trace_file.flush()
+    return functools.partial(_call_with_stats, _trace_path, _trace_every, func)
+
+def task_result(value):
+    """Unwrap the result of a worker_task() task, merging its stats."""
+    if not _enabled:
+        return value
+    result, stats = value
+    merge(stats)
+    return result
+
+def log(message):
+    """Print a per-item message, unless instrumentation (and with it the progress line) is enabled."""
+    if not _enabled:
+        print(message)
+
+class Progress:
+    """Single-line progress with rate, redrawn at most every interval seconds while enabled."""
+
+    def __init__(self, total=None, label='items', interval=1.0):
+        self.total = total
+        self.label = label
+        self.interval = interval
+        self.count = 0
+        self.start = time.perf_counter()
+        self._last = 0.0
+
+    def update(self, n=1):
+        self.count += n
+        if _enabled and not _in_worker:
+            now = time.perf_counter()
+            if now - self._last >= self.interval:
+                self._last = now
+                self._draw(now)
+
+    def _draw(self, now):
+        elapsed = now - self.start
+        rate = self.count / elapsed if elapsed > 0 else 0.0
+        total = f"/{self.total}" if self.total is not None else ''
+        sys.stdout.write(f"\r{self.count}{total} {self.label} ({rate:.1f}/s, {elapsed:.0f}s)")
+        sys.stdout.flush()
+
+    def close(self):
+        if _enabled and not _in_worker:
+            self._draw(time.perf_counter())
+            sys.stdout.write('\n')
+            sys.stdout.flush()
+
+def summary():
+    """Return {stage: {'calls', 'seconds', 'bytes', 'ms_per_call'}}, slowest stage first."""
+    with _lock:
+        items = [(name, list(entry)) for name, entry in _stats.items()]
+    items.sort(key=lambda item: item[1][1], reverse=True)
+    return {name: {'calls': calls, 'seconds': seconds, 'bytes': nbytes,
+                   'ms_per_call': 1000 * seconds / calls if calls else 0.0}
+            for name, (calls, seconds, nbytes) in items}
+
+def report(json_path=None):
+    """Print the summary as a table and optionally write it to json_path as JSON."""
+    stats = summary()
+    print(f"{'stage':<28}{'calls':>10}{'seconds':>11}{'ms/call':>10}{'MB':>10}")
+    for name, entry in stats.items():
+        print(f"{name:<28}{entry['calls']:>10}{entry['seconds']:>11.3f}{entry['ms_per_call']:>10.3f}"
+              f"{entry['bytes'] / 1e6:>10.1f}")
+    if json_path is not None:
+        with open(json_path, 'w') as f:
+            json.dump(stats, f, indent=2)
+    if _trace_file is not None:
+        _trace_file.flush()
+    return stats
@@ -1,59 +1,159 @@
 import os
 import cv2
 import shutil
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 
-# data_path = 'C:/Users/thanapob/Downloads/news1'
-# data_path = 'C:/Users/thanapob/My File/logo-gen_upgraded/output'
-# data_path = "C:/Users/thanapob/Downloads/Yorlok"
-# data_path = 'C:/Users/thanapob/My File/auto_label&whiteout_yolo/output'
-data_path = "C:/Users/thanapob/Downloads/Logo_catagory-20240912T052127Z-001/Logo_catagory/logo-train/logo-train"
-
-images_path  = os.path.join(data_path, 'images')
-labels_path  = os.path.join(data_path, 'labels')
-output_path  = 'cropped_images'
-
-if os.path.exists(output_path):
-    shutil.rmtree(output_path)
-os.makedirs(output_path, exist_ok=True)
-def crop_image(image, labels):
-    h, w, _ = image.shape
+import instrument
+from file_utils import DATASET_IMAGE_EXTENSIONS, list_images
+from image_shards import open_writer
+from label_index import LabelIndex, load_labels
+
+def yolo_to_pixel_boxes(boxes, w, h):
+    """Convert normalised (x_center, y_center, width, height) boxes to clamped pixel (x1, y1, x2, y2)."""
+    boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+    centers = boxes[:, :2] * (w, h)
+    half_sizes = boxes[:, 2:] * (w, h) / 2
+    # Truncate towards zero like int()
+    corners = np.trunc(np.hstack([centers - half_sizes, centers + half_sizes])).astype(np.int64)
+    np.clip(corners[:, 0::2], 0, w, out=corners[:, 0::2])
+    np.clip(corners[:, 1::2], 0, h, out=corners[:, 1::2])
+    return corners
+
+def fit_crop(crop, size, pad=False):
+    """Resize a crop to size (width, height); with pad, keep its aspect ratio and pad with black."""
+    width, height = size
+    if not pad:
+        return cv2.resize(crop, (width, height))
+    h, w = crop.shape[:2]
+    scale = min(width / w, height / h)
+    new_w, new_h = max(1, round(w * scale)), max(1, round(h * scale))
+    resized = cv2.resize(crop, (new_w, new_h))
+    top, left = (height - new_h) // 2, (width - new_w) // 2
+    return cv2.copyMakeBorder(resized, top, height - new_h - top, left, width - new_w - left,
+                              cv2.BORDER_CONSTANT, value=0)
+
+def crop_image(image, labels, size=None, pad=False):
+    """Crop every labelled box out of image. Returns [(class, crop, (x1, y1, x2, y2))].
+
+    labels is either (class ids, boxes) from load_labels or a list of
+    [class, x_center, y_center, width, height] rows. With size, crops are
+    resized (or padded, see fit_crop) to that (width, height).
+    """
+    h, w = image.shape[:2]
+    if isinstance(labels, tuple):
+        classes, boxes = labels
+    else:
+        classes = [label[0] for label in labels]
+        boxes = [label[1:] for label in labels]
     cropped_images = []
-    
-    for label in labels:
-        cls, x_center, y_center, bbox_width, bbox_height = label
-        x_center, y_center, bbox_width, bbox_height = float(x_center), float(y_center), float(bbox_width), float(bbox_height)
-        x_center *= w
-        y_center *= h
-        bbox_width *= w
-        bbox_height *= h
-        x1 = max(int(x_center - bbox_width / 2), 0)
-        y1 = max(int(y_center - bbox_height / 2), 0)
-        x2 = min(int(x_center + bbox_width / 2), w)
-        y2 = min(int(y_center + bbox_height / 2), h)
+    for cls, (x1, y1, x2, y2) in zip(classes, yolo_to_pixel_boxes(boxes, w, h).tolist()):
         cropped_image = image[y1:y2, x1:x2]
-        cropped_images.append((cls, cropped_image))
+        if size is not None and cropped_image.size > 0:
+            cropped_image = fit_crop(cropped_image, size, pad)
+        cropped_images.append((cls, cropped_image, (x1, y1, x2, y2)))
 
     return cropped_images
 
+_worker_writer = None
 
-for image_name in os.listdir(images_path):
-    if image_name.endswith('.jpg') or image_name.endswith('.jpeg') or image_name.endswith('.png'):
-        image_path = os.path.join(images_path, image_name)
+def init_worker(writer_options):
+    """Process-pool initializer: create this process's image writer."""
+    global _worker_writer
+    _worker_writer = open_writer(**writer_options)
+
+def crop_file(image_name, images_path, labels_path, output_path, size=None, pad=False, writer=None, labels=None):
+    """Crop all labelled boxes of one image and queue them on writer. Returns the number of crops.
+
+    labels, if given, are the image's (class ids, boxes), e.g. from a
+    LabelIndex; otherwise its label file is read.
+    """
+    if labels is None:
+        label_path = os.path.join(labels_path, os.path.splitext(image_name)[0] + '.txt')
+        if not os.path.exists(label_path):
+            return 0
+        labels = load_labels(label_path)
+    image_path = os.path.join(images_path, image_name)
+    with instrument.stage('imread', path=image_path):
         image = cv2.imread(image_path)
-        if image_name.endswith('.jpg'):
-            label_file_name = image_name.replace('.jpg', '.txt')
-        elif image_name.endswith('.jpeg'):
-            label_file_name = image_name.replace('.jpeg', '.txt')
-        elif image_name.endswith('.png'):
-            label_file_name = image_name.replace('.png', '.txt')
-        label_path = os.path.join(labels_path, label_file_name)
-        
-        if os.path.exists(label_path):
-            with open(label_path, 'r') as file:
-                labels = [line.strip().split() for line in file.readlines()]
-            cropped_images = crop_image(image, labels)
-        
-            for i, (cls, cropped_image) in enumerate(cropped_images):
-                output_file_name = f"{os.path.splitext(image_name)[0]}_crop_{i}.jpg"
-                output_file_path = os.path.join(output_path, output_file_name)
-                cv2.imwrite(output_file_path, cropped_image)
\ No newline at end of file
+    if image is None:
+        print(f"Failed to load image: {image_path}")
+        return 0
+
+    own_writer = writer is None
+    if own_writer:
+        writer = _worker_writer
+    saved = 0
+    with instrument.stage('crop'):
+        crops = crop_image(image, labels, size, pad)
+    for i, (cls, cropped_image, bbox) in enumerate(crops):
+        if cropped_image.size == 0:
+            instrument.log(f"Cropped image is empty: {image_name} box {i}")
+            continue
+        output_file_name = f"{os.path.splitext(image_name)[0]}_crop_{i}.jpg"
+        output_file_path = os.path.join(output_path, output_file_name)
+        writer.write(output_file_path, cropped_image,
+                     {'source': image_name, 'op': f"_crop_{i}", 'class': int(cls), 'bbox': bbox})
+        saved += 1
+    if own_writer:
+        # Crops must be on disk when the task is reported as done
+        writer.flush()
+    return saved
+
+def crop_folder(data_path, output_path='cropped_images', size=None, pad=False, workers=1, writer_options=None,
+                use_index=False):
+    """Crop every labelled box of data_path/images (labels in data_path/labels) into output_path.
+
+    output_path is recreated from scratch. With workers > 1 images are spread
+    over a process pool. writer_options are passed to image_shards.open_writer,
+    e.g. image_format='png' or shard_folder to pack crops into shard files.
+    With use_index, labels come from the folder's LabelIndex (updated first)
+    instead of parsing every label file.
+    """
+    images_path = os.path.join(data_path, 'images')
+    labels_path = os.path.join(data_path, 'labels')
+    writer_options = writer_options or {}
+
+    if os.path.exists(output_path):
+        shutil.rmtree(output_path)
+    os.makedirs(output_path, exist_ok=True)
+
+    image_names = list_images(images_path, DATASET_IMAGE_EXTENSIONS)
+    image_labels = dict.fromkeys(image_names)
+    if use_index:
+        index = LabelIndex.build(labels_path)
+        image_names = [name for name in image_names if index.file_id(os.path.splitext(name)[0] + '.txt') is not None]
+        image_labels = {name: index.labels_for(os.path.splitext(name)[0] + '.txt') for name in image_names}
+    total = 0
+    progress = instrument.Progress(len(image_names), 'images')
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(writer_options,)) as executor:
+            task = instrument.worker_task(crop_file)
+            futures = [executor.submit(task, image_name, images_path, labels_path, output_path, size, pad,
+                                       labels=image_labels[image_name])
+                       for image_name in image_names]
+            for future in futures:
+                total += instrument.task_result(future.result())
+                progress.update()
+    else:
+        with open_writer(**writer_options) as writer:
+            for image_name in image_names:
+                total += crop_file(image_name, images_path, labels_path, output_path, size, pad, writer,
+                                   image_labels[image_name])
+                progress.update()
+    progress.close()
+    print(f"Saved {total} crops from {len(image_names)} images to {output_path}")
+    return total
+
+if __name__ == '__main__':
+    # data_path = 'C:/Users/thanapob/Downloads/news1'
+    # data_path = 'C:/Users/thanapob/My File/logo-gen_upgraded/output'
+    # data_path = "C:/Users/thanapob/Downloads/Yorlok"
+    # data_path = 'C:/Users/thanapob/My File/auto_label&whiteout_yolo/output'
+    data_path = "C:/Users/thanapob/Downloads/Logo_catagory-20240912T052127Z-001/Logo_catagory/logo-train/logo-train"
+    output_path = 'cropped_images'
+
+    # e.g. size=(224, 224), pad=True for fixed-size crops,
+    # writer_options={'shard_folder': output_path, 'shard_prefix': 'crops'} to pack crops into shard files
+    crop_folder(data_path, output_path, workers=os.cpu_count())
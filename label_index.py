@@ -0,0 +1,162 @@
+import os
+
+import numpy as np
+
+import instrument
+
+def split_label_line(line, label_path, line_number):
+    """Split one line of a YOLO label file into (class id, [value strings]), or None for a blank line.
+
+    The class id must be an integer and be followed by at least four numbers,
+    the box (x_center, y_center, width, height); any further numbers are kept
+    in the values. Raises ValueError naming the file and line otherwise.
+    """
+    parts = line.split()
+    if not parts:
+        return None
+    try:
+        class_id = int(parts[0])
+    except ValueError:
+        raise ValueError(f"{label_path}:{line_number}: class id {parts[0]!r} is not an integer") from None
+    if len(parts) < 5:
+        raise ValueError(f"{label_path}:{line_number}: expected 'class x_center y_center width height', "
+                         f"got {line.strip()!r}")
+    for value in parts[1:]:
+        try:
+            float(value)
+        except ValueError:
+            raise ValueError(f"{label_path}:{line_number}: {value!r} is not a number") from None
+    return class_id, parts[1:]
+
+def load_labels(label_path):
+    """Parse a YOLO label file into (class ids as int32 (N,), boxes as float64 (N, 4)).
+
+    Lines follow split_label_line; columns after the box are ignored. Boxes
+    are rounded to float32 precision, the precision LabelIndex stores, so
+    text and index give the same pixels.
+    """
+    with instrument.stage('read_labels', path=label_path):
+        with open(label_path, 'r') as file:
+            lines = file.read().splitlines()
+    class_ids = []
+    boxes = []
+    for line_number, line in enumerate(lines, 1):
+        parsed = split_label_line(line, label_path, line_number)
+        if parsed is not None:
+            class_ids.append(parsed[0])
+            boxes.append(parsed[1][:4])
+    boxes = np.array(boxes, dtype=np.float64).reshape(-1, 4)
+    return np.array(class_ids, dtype=np.int32), boxes.astype(np.float32).astype(np.float64)
+
+class LabelIndex:
+    """Columnar index of a folder of YOLO label files.
+
+    One row per box: image_id (into `files`), class_id and a float32
+    (x_center, y_center, width, height) bbox. Rows of a file are contiguous,
+    starting at file_start[image_id] with file_count[image_id] rows, in the
+    order of the lines in the file. The index is saved as an .npz file
+    (by default .label_index.npz in the labels folder) and rebuilt
+    incrementally: only files whose size or mtime changed are parsed again.
+    """
+
+    def __init__(self, files, file_size, file_mtime, file_count, class_id, bbox):
+        self.files = list(files)
+        self.file_size = np.asarray(file_size, np.int64)
+        self.file_mtime = np.asarray(file_mtime, np.int64)
+        self.file_count = np.asarray(file_count, np.int64)
+        self.file_start = np.concatenate([[0], np.cumsum(self.file_count)[:-1]]).astype(np.int64)
+        self.class_id = np.asarray(class_id, np.int32)
+        self.bbox = np.asarray(bbox, np.float32).reshape(-1, 4)
+        self.image_id = np.repeat(np.arange(len(self.files), dtype=np.int32), self.file_count)
+        self._file_ids = {name: i for i, name in enumerate(self.files)}
+
+    def __len__(self):
+        return len(self.class_id)
+
+    @staticmethod
+    def default_path(labels_folder):
+        return os.path.join(labels_folder, '.label_index.npz')
+
+    def save(self, index_path):
+        tmp_path = index_path + '.tmp.npz'
+        np.savez(tmp_path, files=np.array(self.files, dtype=str), file_size=self.file_size,
+                 file_mtime=self.file_mtime, file_count=self.file_count, class_id=self.class_id, bbox=self.bbox)
+        os.replace(tmp_path, index_path)
+
+    @classmethod
+    def load(cls, index_path):
+        with np.load(index_path) as data:
+            return cls(data['files'].tolist(), data['file_size'], data['file_mtime'], data['file_count'],
+                       data['class_id'], data['bbox'])
+
+    @classmethod
+    def build(cls, labels_folder, index_path=None):
+        """Load the index of labels_folder, re-parsing only new or changed .txt files, and save it."""
+        if index_path is None:
+            index_path = cls.default_path(labels_folder)
+        old = None
+        if os.path.exists(index_path):
+            try:
+                old = cls.load(index_path)
+            except (OSError, ValueError, KeyError):
+                old = None
+
+        with instrument.stage('listdir'):
+            entries = sorted((entry.name, entry.stat()) for entry in os.scandir(labels_folder)
+                             if entry.name.endswith('.txt') and entry.is_file())
+        files, sizes, mtimes, counts, class_ids, bboxes = [], [], [], [], [], []
+        changed = old is None or len(entries) != len(old.files)
+        for name, st in entries:
+            old_id = old._file_ids.get(name) if old is not None else None
+            if old_id is not None and old.file_size[old_id] == st.st_size and old.file_mtime[old_id] == st.st_mtime_ns:
+                start, count = old.file_start[old_id], old.file_count[old_id]
+                file_classes, file_boxes = old.class_id[start:start + count], old.bbox[start:start + count]
+            else:
+                file_classes, file_boxes = load_labels(os.path.join(labels_folder, name))
+                changed = True
+            files.append(name)
+            sizes.append(st.st_size)
+            mtimes.append(st.st_mtime_ns)
+            counts.append(len(file_classes))
+            class_ids.append(file_classes)
+            bboxes.append(np.asarray(file_boxes, np.float32))
+
+        index = cls(files, sizes, mtimes, counts,
+                    np.concatenate(class_ids) if class_ids else np.zeros(0, np.int32),
+                    np.concatenate(bboxes) if bboxes else np.zeros((0, 4), np.float32))
+        if changed:
+            index.save(index_path)
+        return index
+
+    def file_id(self, label_file):
+        """Image id of a label file name (e.g. 'picture1.txt'), or None if it is not indexed."""
+        return self._file_ids.get(label_file)
+
+    def rows_for_file(self, label_file):
+        """Slice of the rows of one label file (empty if the file is not indexed)."""
+        file_id = self._file_ids.get(label_file)
+        if file_id is None:
+            return slice(0, 0)
+        start = self.file_start[file_id]
+        return slice(start, start + self.file_count[file_id])
+
+    def labels_for(self, label_file):
+        """(class ids, boxes) of one label file, in the same form as load_labels."""
+        rows = self.rows_for_file(label_file)
+        return self.class_id[rows], self.bbox[rows].astype(np.float64)
+
+    def by_class(self, class_id):
+        """Row numbers of all boxes of class_id."""
+        return np.flatnonzero(self.class_id == class_id)
+
+    def by_image(self, label_file):
+        """Row numbers of all boxes of one label file."""
+        rows = self.rows_for_file(label_file)
+        return np.arange(rows.start, rows.stop)
+
+    def by_size(self, min_area=0.0, max_area=1.0, min_width=0.0, min_height=0.0):
+        """Row numbers of boxes whose normalised area and sides fall in the given bounds."""
+        widths, heights = self.bbox[:, 2], self.bbox[:, 3]
+        areas = widths * heights
+        return np.flatnonzero((areas >= min_area) & (areas <= max_area) &
+                              (widths >= min_width) & (heights >= min_height))
@@ -1,78 +1,133 @@
+import hashlib
+import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 
-def reformat_labels(labels_folder, output_folder, classes_file):
+import instrument
+from file_utils import save_json
+from label_index import LabelIndex, split_label_line
+
+def parse_label_lines(file_path):
+    """Read a label file once into [(class id, [coordinate strings])], skipping blank lines.
+
+    Lines are checked by label_index.split_label_line, which raises
+    ValueError naming the file and line.
+    """
+    parsed = []
+    with instrument.stage('read_labels', path=file_path), open(file_path, 'r') as file:
+        for line_number, line in enumerate(file, 1):
+            values = split_label_line(line, file_path, line_number)
+            if values is not None:
+                parsed.append(values)
+    return parsed
+
+def class_ids_by_file(labels_folder, index=None):
+    """Yield (filename, [class id of each line], parsed lines or None) for the label files of a folder.
+
+    With a LabelIndex the ids come from the index and the text files are not
+    read (parsed lines is None); otherwise each file is read once.
+    """
+    if index is not None:
+        for filename in index.files:
+            yield filename, index.class_id[index.rows_for_file(filename)].tolist(), None
+        return
+    # Sorted like the index, so both give the same numbering on every machine
+    with instrument.stage('listdir'):
+        filenames = sorted(os.listdir(labels_folder))
+    for filename in filenames:
+        if filename.endswith('.txt'):
+            parsed = parse_label_lines(os.path.join(labels_folder, filename))
+            yield filename, [old_index for old_index, _ in parsed], parsed
+
+def write_label_file(file_path, output_file_path, parsed, mapping):
+    """Write one remapped label file. parsed is read from file_path if None."""
+    if parsed is None:
+        parsed = parse_label_lines(file_path)
+    with instrument.stage('write_labels', path=output_file_path), open(output_file_path, 'w') as file:
+        for old_index, coordinates in parsed:
+            file.write(f"{mapping[old_index]} {' '.join(coordinates)}\n")
+
+def reformat_labels(labels_folder, output_folder, classes_file, use_index=False, workers=8, state_file=None):
+    """Give every (file category, class) pair its own class index and write the new labels.
+
+    The category of a label file is its name up to the last '_'. Each label
+    file is read once; with use_index, class ids come from the folder's
+    LabelIndex (updated first) and files are only read when they are written.
+
+    Output files are written on `workers` threads. A state file (by default
+    .reformat_state.json in output_folder) records the size and mtime of
+    every input and the mapping used for it, and files whose input and
+    mapping are unchanged since the last run are not rewritten.
+    """
     # Create output folder if it doesn't exist
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
+    if state_file is None:
+        state_file = os.path.join(output_folder, '.reformat_state.json')
 
-    # Mapping of old index to new index and category name to new category names
-    index_mapping = {}
+    # Mapping of category name to {old index: new index}
     category_mapping = {}
     new_index_counter = 0
+    files = []
 
     # Read files and organize by category and index
-    for filename in os.listdir(labels_folder):
-        if filename.endswith('.txt'):
-            category_name = filename.rsplit('_', 1)[0]
-            file_path = os.path.join(labels_folder, filename)
-
-            if category_name not in category_mapping:
-                category_mapping[category_name] = {}
-
-            with open(file_path, 'r') as file:
-                lines = file.readlines()
+    label_index = LabelIndex.build(labels_folder) if use_index else None
+    for filename, old_indices, parsed in class_ids_by_file(labels_folder, label_index):
+        category_name = filename.rsplit('_', 1)[0]
+        files.append((filename, category_name, parsed))
 
-            for line in lines:
-                parts = line.strip().split()
-                old_index = int(parts[0])
+        if category_name not in category_mapping:
+            category_mapping[category_name] = {}
 
-                # Assign new index if necessary
-                if old_index not in category_mapping[category_name]:
-                    category_mapping[category_name][old_index] = new_index_counter
-                    new_index_counter += 1
-
-                new_index = category_mapping[category_name][old_index]
-                index_mapping[(category_name, old_index)] = new_index
+        for old_index in old_indices:
+            # Assign new index if necessary
+            if old_index not in category_mapping[category_name]:
+                category_mapping[category_name][old_index] = new_index_counter
+                new_index_counter += 1
 
     # Rename categories with multiple indices
-    final_category_mapping = {}
     new_categories = {}
     for category_name, indices in category_mapping.items():
-        if len(indices) > 1:
-            for old_index, new_index in indices.items():
-                new_category_name = f"{category_name}{old_index + 1}"
-                final_category_mapping[(category_name, old_index)] = new_index
-                new_categories[new_index] = new_category_name
-        else:
-            new_category_name = category_name
-            for old_index, new_index in indices.items():
-                final_category_mapping[(category_name, old_index)] = new_index
-                new_categories[new_index] = new_category_name
-
-    # Write new label files
-    for filename in os.listdir(labels_folder):
-        if filename.endswith('.txt'):
-            category_name = filename.rsplit('_', 1)[0]
-            file_path = os.path.join(labels_folder, filename)
-            output_file_path = os.path.join(output_folder, filename)
-            
-            with open(file_path, 'r') as file:
-                lines = file.readlines()
-            
-            with open(output_file_path, 'w') as file:
-                for line in lines:
-                    parts = line.strip().split()
-                    old_index = int(parts[0])
-                    new_index = final_category_mapping[(category_name, old_index)]
-                    file.write(f"{new_index} {' '.join(parts[1:])}\n")
+        for old_index, new_index in indices.items():
+            if len(indices) > 1:
+                new_categories[new_index] = f"{category_name}{old_index + 1}"
+            else:
+                new_categories[new_index] = category_name
+
+    previous_state = {}
+    if os.path.exists(state_file):
+        with open(state_file, 'r') as file:
+            previous_state = json.load(file)
+
+    # Write new label files whose input or mapping changed
+    state = {}
+    jobs = []
+    for filename, category_name, parsed in files:
+        file_path = os.path.join(labels_folder, filename)
+        output_file_path = os.path.join(output_folder, filename)
+        mapping = category_mapping[category_name]
+        st = os.stat(file_path)
+        mapping_digest = hashlib.sha1(json.dumps(sorted(mapping.items())).encode()).hexdigest()
+        state[filename] = [st.st_size, st.st_mtime_ns, mapping_digest]
+        if previous_state.get(filename) == state[filename] and os.path.exists(output_file_path):
+            continue
+        jobs.append((file_path, output_file_path, parsed, mapping))
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        for future in [executor.submit(write_label_file, *job) for job in jobs]:
+            future.result()
+    print(f"Wrote {len(jobs)} of {len(files)} label files ({len(files) - len(jobs)} unchanged)")
+
+    save_json(state, state_file)
 
     # Write classes.txt
     with open(classes_file, 'w') as file:
         for index in sorted(new_categories):
             file.write(f"{new_categories[index]}\n")
 
-# Example usage
-labels_folder = "logo-train/labels"
-output_folder = "logo-train/new_labels"
-classes_file = "logo-train/classes.txt"
-reformat_labels(labels_folder, output_folder, classes_file)
+if __name__ == '__main__':
+    # Example usage
+    labels_folder = "logo-train/labels"
+    output_folder = "logo-train/new_labels"
+    classes_file = "logo-train/classes.txt"
+    reformat_labels(labels_folder, output_folder, classes_file)
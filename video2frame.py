@@ -1,34 +1,256 @@
 import cv2
+import json
+import math
 import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-def extract_frames(video_path, output_folder, frame_rate=1):
+import instrument
+from file_utils import save_json
+from image_writer import AsyncImageWriter
+from image_shards import open_writer
+
+def sample_period(frame_rate=1, interval=None):
+    """Seconds between samples, from a target frame rate or an explicit interval."""
+    period = interval if interval is not None else 1.0 / frame_rate
+    if period <= 0:
+        raise ValueError("frame_rate and interval must be positive")
+    return period
+
+def sample_frame_index(k, period, fps):
+    """Index of the first video frame at or after the time of sample k."""
+    return math.ceil(k * period * fps - 1e-6)
+
+def sample_frames(vidcap, fps, period, start_k=0, stop_k=None, seek=False):
+    """Yield (sample id, frame) for samples start_k <= k < stop_k of an opened video.
+
+    Sample k is the first frame at or after k * period seconds. Frames between
+    samples are skipped with grab(), or with a seek when seek is True. With
+    the FFmpeg backend grab() still decodes each frame and only saves the
+    colour conversion and copy; seeking is what avoids decoding the frames in
+    between, and pays off when samples are far apart. If several samples fall on the same frame (period
+    shorter than a frame), the frame is yielded once, under the first id.
+    """
+    k = start_k
+    target = sample_frame_index(k, period, fps)
+    index = 0
+    if target > 0:
+        vidcap.set(cv2.CAP_PROP_POS_FRAMES, target)
+        index = target
+    while stop_k is None or k < stop_k:
+        if seek and target - index > 1:
+            with instrument.stage('video_seek'):
+                vidcap.set(cv2.CAP_PROP_POS_FRAMES, target)
+            index = target
+        while index < target:
+            with instrument.stage('video_grab'):
+                grabbed = vidcap.grab()
+            if not grabbed:
+                return
+            index += 1
+        with instrument.stage('video_decode'):
+            success, image = vidcap.read()
+        if not success:
+            return
+        yield k, image
+        index += 1
+        while target < index:
+            k += 1
+            target = sample_frame_index(k, period, fps)
+
+def frame_hash(image):
+    """64-bit difference hash of a frame: signs of horizontal gradients of a 9x8 grey thumbnail."""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(''.join('1' if bit else '0' for bit in bits), 2)
+
+def dedup_frames(frames, threshold):
+    """Drop frames whose hash is within threshold bits of the last kept frame.
+
+    frames yields (frame_id, image); kept frames are yielded unchanged and
+    dropped ones are reported.
+    """
+    last_id = last_hash = None
+    for frame_id, image in frames:
+        with instrument.stage('frame_hash'):
+            current = frame_hash(image)
+        if last_hash is not None:
+            distance = bin(current ^ last_hash).count('1')
+            if distance <= threshold:
+                instrument.log(f"Skipped frame {frame_id}: near-duplicate of frame {last_id} (distance {distance})")
+                continue
+        last_id, last_hash = frame_id, current
+        yield frame_id, image
+
+def iter_frames(video_path, frame_rate=1, interval=None, seek=False, dedup_threshold=None):
+    """Yield (frame_id, frame) samples of a video in memory, without writing anything.
+
+    Sampling and deduplication work as in extract_frames.
+    """
+    period = sample_period(frame_rate, interval)
+    vidcap = cv2.VideoCapture(video_path)
+    if not vidcap.isOpened():
+        raise IOError(f"Could not open video: {video_path}")
+    fps = vidcap.get(cv2.CAP_PROP_FPS)
+    if fps <= 0:
+        vidcap.release()
+        raise IOError(f"Could not read the frame rate of {video_path}")
+    try:
+        frames = sample_frames(vidcap, fps, period, seek=seek)
+        if dedup_threshold is not None:
+            frames = dedup_frames(frames, dedup_threshold)
+        yield from frames
+    finally:
+        vidcap.release()
+
+def extract_frames(video_path, output_folder, frame_rate=1, interval=None, seek=False, writer=None,
+                   prefix='framettn7', dedup_threshold=None):
+    """Save frames of a video as images.
+
+    Frames are sampled at frame_rate frames per second, or one every interval
+    seconds if interval is given; both may be fractional. Unwanted frames are
+    skipped with grab(), which saves the colour conversion but (with the
+    FFmpeg backend) not the decoding; seek=True seeks to each sample instead,
+    which does skip decoding and is the faster mode for sparse sampling such
+    as 1 frame per second (see sample_frames). Frames are written through
+    writer (an AsyncImageWriter).
+
+    With dedup_threshold set, sampled frames within that many bits (out of
+    64) of the last kept frame's hash are dropped; see dedup_frames.
+    """
+    period = sample_period(frame_rate, interval)
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
-    
+
     vidcap = cv2.VideoCapture(video_path)
     if not vidcap.isOpened():
         print("Error: Could not open video.")
         return
-    
+
     total_frames = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
     fps = vidcap.get(cv2.CAP_PROP_FPS)
     print(f"Total frames: {total_frames}, FPS: {fps}")
-    
-    count = 0
-    success = True
-    
-    while success:
-        success, image = vidcap.read()
-        if success and count % (int(fps) // frame_rate) == 0:
-            frame_id = count // (int(fps) // frame_rate)
-            output_path = os.path.join(output_folder, f"framettn7_{frame_id:04d}.jpg")
-            cv2.imwrite(output_path, image)
-            print(f"Saved frame {frame_id} to {output_path}")
-        count += 1
-    
+    if fps <= 0:
+        print("Error: Could not read the video frame rate.")
+        vidcap.release()
+        return
+
+    own_writer = writer is None
+    if own_writer:
+        writer = AsyncImageWriter()
+    frames = sample_frames(vidcap, fps, period, seek=seek)
+    if dedup_threshold is not None:
+        frames = dedup_frames(frames, dedup_threshold)
+    progress = instrument.Progress(label='frames')
+    for frame_id, image in frames:
+        output_path = os.path.join(output_folder, f"{prefix}_{frame_id:04d}.jpg")
+        output_path = writer.write(output_path, image)
+        instrument.log(f"Saved frame {frame_id} to {output_path}")
+        progress.update()
+    progress.close()
+
+    vidcap.release()
+    if own_writer:
+        writer.close()
+    else:
+        writer.flush()
+    print("Finished extracting frames.")
+
+def extract_segment(video_path, output_folder, prefix, period, start_k, stop_k, seek=False, writer_options=None,
+                    dedup_threshold=None):
+    """Extract samples start_k <= k < stop_k of a video. Runs in worker processes."""
+    vidcap = cv2.VideoCapture(video_path)
+    if not vidcap.isOpened():
+        raise IOError(f"Could not open video: {video_path}")
+    fps = vidcap.get(cv2.CAP_PROP_FPS)
+    saved = 0
+    frames = sample_frames(vidcap, fps, period, start_k, stop_k, seek)
+    if dedup_threshold is not None:
+        frames = dedup_frames(frames, dedup_threshold)
+    with open_writer(**(writer_options or {})) as writer:
+        for frame_id, image in frames:
+            writer.write(os.path.join(output_folder, f"{prefix}_{frame_id:04d}.jpg"), image)
+            saved += 1
     vidcap.release()
+    return saved
+
+def plan_segments(video_path, period, segment_seconds):
+    """Split a video into [start_k, stop_k) sample ranges of about segment_seconds each.
+
+    The last segment is open-ended (stop_k None), since the container's frame
+    count is not always exact.
+    """
+    vidcap = cv2.VideoCapture(video_path)
+    if not vidcap.isOpened():
+        raise IOError(f"Could not open video: {video_path}")
+    fps = vidcap.get(cv2.CAP_PROP_FPS)
+    total_frames = int(vidcap.get(cv2.CAP_PROP_FRAME_COUNT))
+    vidcap.release()
+    if fps <= 0:
+        raise IOError(f"Could not read the frame rate of {video_path}")
+    total_samples = math.ceil(total_frames / fps / period) if total_frames > 0 else 0
+    samples_per_segment = max(1, math.ceil(segment_seconds / period))
+    segments = []
+    for start_k in range(0, max(total_samples, 1), samples_per_segment):
+        segments.append([start_k, start_k + samples_per_segment])
+    segments[-1][1] = None
+    return segments
+
+def extract_videos(video_paths, output_root, frame_rate=1, interval=None, segment_seconds=600,
+                   workers=None, seek=False, manifest_path=None, writer_options=None, dedup_threshold=None):
+    """Extract frames from many videos, decoding time segments in parallel processes.
+
+    Frames of each video go to output_root/<video name>/<video name>_<id>.jpg,
+    where id is the sample number from the start of the video, so ids do not
+    depend on how the video was split. Finished segments are recorded in a
+    JSON manifest (output_root/extract_manifest.json by default); running
+    again with the same settings skips them.
+
+    dedup_threshold works as in extract_frames, within each segment.
+    """
+    period = sample_period(frame_rate, interval)
+    os.makedirs(output_root, exist_ok=True)
+    if manifest_path is None:
+        manifest_path = os.path.join(output_root, 'extract_manifest.json')
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+
+    jobs = []
+    for video_path in video_paths:
+        key = os.path.abspath(video_path)
+        entry = manifest.get(key)
+        if entry is None or entry['period'] != period or entry['segment_seconds'] != segment_seconds:
+            entry = manifest[key] = {
+                'period': period,
+                'segment_seconds': segment_seconds,
+                'segments': plan_segments(video_path, period, segment_seconds),
+                'done': [],
+            }
+        name = os.path.splitext(os.path.basename(video_path))[0]
+        output_folder = os.path.join(output_root, name)
+        os.makedirs(output_folder, exist_ok=True)
+        for segment_id, (start_k, stop_k) in enumerate(entry['segments']):
+            if segment_id not in entry['done']:
+                jobs.append((key, segment_id, (video_path, output_folder, name, period, start_k, stop_k,
+                                               seek, writer_options, dedup_threshold)))
+    save_json(manifest, manifest_path, indent=1)
+    print(f"{len(jobs)} segments to extract from {len(video_paths)} videos")
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        task = instrument.worker_task(extract_segment)
+        futures = {executor.submit(task, *args): (key, segment_id) for key, segment_id, args in jobs}
+        for future in as_completed(futures):
+            key, segment_id = futures[future]
+            saved = instrument.task_result(future.result())
+            manifest[key]['done'].append(segment_id)
+            save_json(manifest, manifest_path, indent=1)
+            print(f"Saved {saved} frames from {key} segment {segment_id}")
     print("Finished extracting frames.")
 
-video_path= 'video/TNN16_20240624_173000.mp4'
-output_folder='frame'
-extract_frames(video_path,output_folder,frame_rate=1)
+if __name__ == '__main__':
+    video_path= 'video/TNN16_20240624_173000.mp4'
+    output_folder='frame'
+    extract_frames(video_path,output_folder,frame_rate=1)
+    # extract_videos(['video/TNN16_20240624_173000.mp4', 'video/TNN16_20240624_180000.mp4'], 'frame', frame_rate=1)
@@ -2,75 +2,161 @@ import os
 import cv2  # OpenCV for image processing
 import shutil
 
-# Directories
-input_image_dir = 'logo-train/images'
-input_label_dir = 'logo-train/new_labels'
-output_dir = 'l_dataset/train'
-classes_path = 'logo-train/classes.txt'
-
-
-if os.path.exists(output_dir):
-    shutil.rmtree(output_dir)
-with open(classes_path, 'r') as f:
-    classes = [line.strip() for line in f.readlines()]
-
-# Create directories for each class
-for class_name in classes:
-    os.makedirs(os.path.join(output_dir, class_name), exist_ok=True)
-
-# Process each label file
-for label_file in os.listdir(input_label_dir):
-    if label_file.endswith('.txt'):
-        base_name = os.path.splitext(label_file)[0]
-        image_file = f'{base_name}.jpg'  # or .png, depending on your image format
-
-        # Load image
-        image_path = os.path.join(input_image_dir, image_file)
-        if not os.path.isfile(image_path):
-            print(f"Image file not found: {image_path}")
-            continue
-        image = cv2.imread(image_path)
+import instrument
+from file_utils import DATASET_IMAGE_EXTENSIONS
+from image_cache import LRUImageCache
+from image_probe import image_size
+from image_writer import AsyncImageWriter
+from label_crop import yolo_to_pixel_boxes
+from label_index import LabelIndex, load_labels
+
+try:
+    from torch.utils.data import Dataset
+except ImportError:  # torch is optional; without it the dataset is a plain sequence
+    Dataset = object
+
+class YoloCropDataset(Dataset):
+    """Map-style dataset of the labelled boxes of a YOLO dataset, cropped on demand.
+
+    The index of (image path, class, box) is built from the label folder;
+    __getitem__ returns (crop, class index), applying transform to the crop if
+    given. Decoded images are kept in an LRU cache of cache_bytes so boxes from
+    the same image decode it once. Samples are ordered by image, which keeps
+    sequential access cache-friendly. With use_index the boxes come from the
+    label folder's LabelIndex instead of parsing every label file.
+
+    Boxes that are less than a pixel wide or high, or that lie outside the
+    image, would give empty crops; they are left out of the samples (image
+    sizes are read from the file headers) and counted in a message.
+    """
+
+    def __init__(self, image_dir, label_dir, classes_path=None, transform=None, cache_bytes=256 * 1024 * 1024,
+                 use_index=False):
+        self.image_dir = image_dir
+        self.label_dir = label_dir
+        self.transform = transform
+        self.classes = None
+        if classes_path is not None:
+            with open(classes_path, 'r') as f:
+                self.classes = [line.strip() for line in f.readlines()]
+        self.cache = LRUImageCache(cache_bytes)
+
+        images = {}
+        for image_file in sorted(os.listdir(image_dir)):
+            if image_file.lower().endswith(DATASET_IMAGE_EXTENSIONS):
+                images.setdefault(os.path.splitext(image_file)[0], image_file)
+
+        # (image path, class index, normalised box, box number within its label file)
+        self.samples = []
+        skipped = 0
+        index = LabelIndex.build(label_dir) if use_index else None
+        label_files = index.files if index is not None else sorted(os.listdir(label_dir))
+        for label_file in label_files:
+            if not label_file.endswith('.txt'):
+                continue
+            base_name = os.path.splitext(label_file)[0]
+            if base_name not in images:
+                print(f"Image file not found for label: {os.path.join(label_dir, label_file)}")
+                continue
+            image_path = os.path.join(image_dir, images[base_name])
+            if index is not None:
+                class_ids, boxes = index.labels_for(label_file)
+            else:
+                class_ids, boxes = load_labels(os.path.join(label_dir, label_file))
+            size = image_size(image_path)
+            if size is None:
+                print(f"Failed to load image: {image_path}")
+                continue
+            width, height = size
+            corners = yolo_to_pixel_boxes(boxes, width, height)
+            valid = ((corners[:, 2] > corners[:, 0]) & (corners[:, 3] > corners[:, 1]) &
+                     (boxes[:, 2] * width >= 1) & (boxes[:, 3] * height >= 1))
+            skipped += len(valid) - int(valid.sum())
+            for box_number, (class_idx, box, keep) in enumerate(zip(class_ids.tolist(), boxes, valid.tolist())):
+                if keep:
+                    self.samples.append((image_path, class_idx, box, box_number))
+        if skipped:
+            print(f"Skipped {skipped} boxes smaller than a pixel or outside their image")
+
+    def __len__(self):
+        return len(self.samples)
+
+    def load_image(self, image_path):
+        """Decode image_path, or return it from the cache. The returned array is read-only."""
+        image = self.cache.get(image_path)
         if image is None:
-            print(f"Failed to load image: {image_path}")
+            with instrument.stage('imread', path=image_path):
+                image = cv2.imread(image_path)
+            if image is None:
+                raise IOError(f"Failed to load image: {image_path}")
+            image = self.cache.put(image_path, image)
+        else:
+            instrument.record('image_cache_hit')
+        return image
+
+    def crop(self, index):
+        """Return (crop, class index, (x1, y1, x2, y2)) for sample index, without the transform."""
+        image_path, class_idx, box, _ = self.samples[index]
+        image = self.load_image(image_path)
+        img_height, img_width = image.shape[:2]
+        with instrument.stage('crop'):
+            x_min, y_min, x_max, y_max = yolo_to_pixel_boxes(box, img_width, img_height)[0].tolist()
+            # Copy so the caller may modify the crop without touching the cached image
+            cropped_image = image[y_min:y_max, x_min:x_max].copy()
+        return cropped_image, class_idx, (x_min, y_min, x_max, y_max)
+
+    def __getitem__(self, index):
+        cropped_image, class_idx, _ = self.crop(index)
+        if self.transform is not None:
+            with instrument.stage('transform'):
+                cropped_image = self.transform(cropped_image)
+        return cropped_image, class_idx
+
+def export_crops(dataset, output_dir, writer=None):
+    """Write every crop of dataset to output_dir/<class name>/<image name>_<box number>.jpg."""
+    if os.path.exists(output_dir):
+        shutil.rmtree(output_dir)
+    for class_name in dataset.classes:
+        os.makedirs(os.path.join(output_dir, class_name), exist_ok=True)
+    own_writer = writer is None
+    if own_writer:
+        writer = AsyncImageWriter()
+
+    progress = instrument.Progress(len(dataset.samples), 'crops')
+    for index, (image_path, class_idx, _, box_number) in enumerate(dataset.samples):
+        progress.update()
+        try:
+            cropped_image, _, bbox = dataset.crop(index)
+        except IOError as error:
+            print(error)
+            continue
+        # Check if cropped image is valid
+        if cropped_image.size == 0:
+            instrument.log(f"Cropped image is empty: {image_path} box {box_number}")
             continue
+        class_name = dataset.classes[class_idx]
+        image_file = os.path.basename(image_path)
+        output_name = f"{os.path.splitext(image_file)[0]}_{box_number}.jpg"
+        writer.write(os.path.join(output_dir, class_name, output_name), cropped_image,
+                     {'source': image_file, 'class': class_name, 'bbox': list(bbox)})
 
-        # Read label file
-        with open(os.path.join(input_label_dir, label_file), 'r') as f:
-            labels = f.readlines()
-
-        # Process each bounding box
-        for label in labels:
-            parts = label.strip().split()
-            class_idx = int(parts[0])
-            x_center, y_center, width, height = map(float, parts[1:])
-
-            # Convert YOLO format to bounding box coordinates
-            img_height, img_width = image.shape[:2]
-            x_min = int((x_center - width / 2) * img_width)
-            x_max = int((x_center + width / 2) * img_width)
-            y_min = int((y_center - height / 2) * img_height)
-            y_max = int((y_center + height / 2) * img_height)
-
-            # Ensure crop coordinates are within image bounds
-            x_min = max(x_min, 0)
-            y_min = max(y_min, 0)
-            x_max = min(x_max, img_width)
-            y_max = min(y_max, img_height)
-
-            # Crop the image
-            cropped_image = image[y_min:y_max, x_min:x_max]
-
-            # Check if cropped image is valid
-            if cropped_image.size == 0:
-                print(f"Cropped image is empty: {image_file}")
-                continue
+    if own_writer:
+        writer.close()
+    else:
+        writer.flush()
+    progress.close()
+
+if __name__ == '__main__':
+    # Directories
+    input_image_dir = 'logo-train/images'
+    input_label_dir = 'logo-train/new_labels'
+    output_dir = 'l_dataset/train'
+    classes_path = 'logo-train/classes.txt'
 
-            # Determine class name and save cropped image
-            class_name = classes[class_idx]
-            output_path = os.path.join(output_dir, class_name, image_file)
-            os.makedirs(os.path.dirname(output_path), exist_ok=True)
-            cv2.imwrite(output_path, cropped_image)
+    dataset = YoloCropDataset(input_image_dir, input_label_dir, classes_path)
+    print(f"{len(dataset)} boxes in {len(dataset.classes)} classes")
 
-        # Optionally, you may want to remove the original image and label files if no longer needed
-        # os.remove(image_path)
-        # os.remove(os.path.join(input_label_dir, label_file))
\ No newline at end of file
+    # Crops are produced on the fly, e.g. torch.utils.data.DataLoader(dataset, ...).
+    # To write them out as an ImageFolder-style tree (or into shard files) instead:
+    # export_crops(dataset, output_dir)
+    # export_crops(dataset, output_dir, image_shards.ShardWriter(output_dir, prefix='train'))